@@ -1,9 +1,11 @@
 import sublime
 import sublime_plugin
+import hashlib
+import json
 import os
-import time
 from .rust import (messages, rust_proc, rust_thread, util, target_detect,
-                   cargo_settings, semver, log)
+                   cargo_settings, versions, check_target, shadow, watcher,
+                   log, shell_env)
 
 
 """On-save syntax checking.
@@ -13,32 +15,155 @@ whenever you save a Rust file.
 """
 
 
+class CheckState(object):
+
+    """On-save check bookkeeping for one Cargo package in a window."""
+
+    # The most recently saved view.
+    view = None
+    # The package directory (or None if not in a Cargo package).
+    cwd = None
+    # Settings that affected the most recent check.
+    settings_key = None
+    # Incremented by each save, used for debouncing.
+    token = 0
+    # The most recent RustSyntaxCheckThread.
+    thread = None
+    # `messages.generation` once the most recent check finished, or None if
+    # it did not complete.
+    generation = None
+
+    def __init__(self):
+        # Set of paths of Rust files saved since the last check was
+        # scheduled.
+        self.saved = set()
+        # {path: content hash} of saved files as of the most recent check.
+        self.hashes = {}
+        # {path: mtime} of the package files other than the Rust sources
+        # (see `_package_stamp`) as of the most recent check.
+        self.stamp = {}
+
+
+# Key is (window id, package directory), value is CheckState.
+CHECK_STATES = {}
+
+
+def _hash_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _package_stamp(cwd):
+    """Returns {path: mtime} for the files of a package that affect a check
+    but are not Rust sources (the manifests, lock file and build script)."""
+    if cwd is None:
+        return {}
+    paths = [os.path.join(cwd, 'Cargo.toml'), os.path.join(cwd, 'build.rs')]
+    # The lock file (and the workspace manifest beside it) may be in a
+    # parent directory.
+    for path in util.parent_dirs(cwd):
+        lock = os.path.join(path, 'Cargo.lock')
+        if os.path.exists(lock):
+            paths.append(lock)
+            paths.append(os.path.join(path, 'Cargo.toml'))
+            break
+    return {path: util.file_mtime(path) for path in paths}
+
+
+# Incremented whenever the settings files change.
+SETTINGS_GENERATION = 0
+
+
+def _settings_changed():
+    global SETTINGS_GENERATION
+    SETTINGS_GENERATION += 1
+
+
+def _settings_key(window):
+    """Returns a value that changes whenever a setting that may affect the
+    check changes (such as features, toolchain or environment)."""
+    # Project settings do not have change notifications, so they are
+    # compared directly.
+    pdata = window.project_data() or {}
+    project = json.dumps(pdata.get('settings', {}), sort_keys=True)
+    return (SETTINGS_GENERATION, shell_env.generation, project)
+
+
 # TODO: Use ViewEventListener if
 # https://github.com/SublimeTextIssues/Core/issues/2411 is fixed.
 class RustSyntaxCheckEvent(sublime_plugin.EventListener):
 
-    last_save = 0
-
     def on_post_save(self, view):
         enabled = util.get_setting('rust_syntax_checking', True)
         if not enabled or not util.active_view_is_rust(view=view):
             return
-        prev_save = self.last_save
-        self.last_save = time.time()
-        if self.last_save - prev_save < 0.25:
-            # This is a guard for a few issues.
-            # * `on_post_save` gets called multiple times if the same buffer
-            #   is opened in multiple views (with the same view passed in each
-            #   time). See:
-            #   https://github.com/SublimeTextIssues/Core/issues/289
-            # * When using "Save All" we want to avoid launching a bunch of
-            #   threads and then immediately killing them.
-            return
-        log.clear_log(view.window())
+        # Saves are debounced per package.  This handles a few issues:
+        # * `on_post_save` gets called multiple times if the same buffer
+        #   is opened in multiple views (with the same view passed in each
+        #   time). See:
+        #   https://github.com/SublimeTextIssues/Core/issues/289
+        # * When using "Save All" we want to avoid launching a bunch of
+        #   threads and then immediately killing them.
+        path = os.path.abspath(view.file_name())
+        cwd = util.find_cargo_manifest(path)
+        state = CHECK_STATES.setdefault((view.window().id(), cwd),
+                                        CheckState())
+        state.cwd = cwd
+        state.saved.add(path)
+        state.view = view
+        state.token += 1
+        token = state.token
+        delay = util.get_setting('rust_syntax_checking_debounce', 250)
+        sublime.set_timeout_async(lambda: self._check(state, token), delay)
+
+    def _check(self, state, token):
+        if token != state.token:
+            # Another file was saved since then.
+            return
+        view = state.view
+        window = view.window()
+        if window is None:
+            # View was closed.
+            return
+        saved = state.saved
+        state.saved = set()
+        hashes = dict(state.hashes)
+        for path in saved:
+            hashes[path] = _hash_file(path)
+        settings_key = _settings_key(window)
+        stamp = _package_stamp(state.cwd)
+        skip_unchanged = util.get_setting(
+            'rust_syntax_checking_skip_unchanged', True)
+        if (skip_unchanged and hashes == state.hashes and
+                stamp == state.stamp and settings_key == state.settings_key):
+            t = state.thread
+            if t is not None and t.is_alive() and not t.should_exit:
+                log.log(window, 'On-save check already running for the '
+                        'current contents, not restarting.')
+                return
+            if state.generation == messages.generation(window):
+                log.log(window, 'Files unchanged since the last check, '
+                        'keeping its results.')
+                return
+        state.hashes = hashes
+        state.stamp = stamp
+        state.settings_key = settings_key
+        state.generation = None
+        log.clear_log(window)
         messages.erase_status(view)
-        t = RustSyntaxCheckThread(view)
+        t = RustSyntaxCheckThread(view, state)
+        state.thread = t
         t.start()
 
+    def on_pre_close_window(self, window):
+        wid = window.id()
+        for key in [key for key in CHECK_STATES if key[0] == wid]:
+            del CHECK_STATES[key]
+        messages.WINDOW_GENERATIONS.pop(wid, None)
+
 
 class RustSyntaxCheckThread(rust_thread.RustThread, rust_proc.ProcListener):
 
@@ -62,15 +187,36 @@ class RustSyntaxCheckThread(rust_thread.RustThread, rust_proc.ProcListener):
     # The path to the top-level Cargo target filename (like main.rs or
     # lib.rs).
     current_target_src = None
+    # If True, all targets are checked with one Cargo process, and
+    # `current_target_src` is not used.
+    combined_targets = False
+    # Set of `src_path` of the targets that contain the triggered file.
+    owner_srcs = None
+    # Set of `(src_path, test)` of the units Cargo has finished.  `test` is
+    # the `test` flag of the unit's profile, since the same target may be
+    # compiled more than once (such as a library with and without the test
+    # harness).
+    finished_units = None
+    # True if the current Cargo command uses the test profile.
+    test_profile = False
+    # True if the check was stopped because all units of `owner_srcs`
+    # finished.
+    stopped_early = False
     done = False
+    # CheckState of the package, or None.
+    state = None
+    # Directory where Cargo is run, if different from `cwd`.
+    run_cwd = None
 
-    def __init__(self, view):
+    def __init__(self, view, state=None):
         self.view = view
         self.window = view.window()
+        self.state = state
         super(RustSyntaxCheckThread, self).__init__(view.window())
 
     def run(self):
-        self.triggered_file_name = os.path.abspath(self.view.file_name())
+        if self.view is not None:
+            self.triggered_file_name = os.path.abspath(self.view.file_name())
         self.cwd = util.find_cargo_manifest(self.triggered_file_name)
         if self.cwd is None:
             # A manifest is required.
@@ -97,6 +243,9 @@ class RustSyntaxCheckThread(rust_thread.RustThread, rust_proc.ProcListener):
         finally:
             self.done = True
         messages.messages_finished(self.window)
+        if self.state is not None and not self.should_exit:
+            # Saving without changes can reuse these results.
+            self.state.generation = messages.generation(self.window)
         counts = messages.message_counts(self.window)
         if counts:
             msg = []
@@ -163,28 +312,133 @@ class RustSyntaxCheckThread(rust_thread.RustThread, rust_proc.ProcListener):
         targets = td.determine_targets(self.triggered_file_name, metadata=metadata)
         if not targets:
             return -1
+        # Targets that contain the triggered file.  Once all of them have
+        # been built, the check can stop.
+        self.owner_srcs = set(src for src, _ in targets
+                              if src and os.path.isabs(src))
+        if targets == [(None, [])]:
+            # The whole package is checked.  A file that is the root of a
+            # target Cargo does not select on its own (such as build.rs)
+            # is done once that target is built.
+            self.owner_srcs = self._root_srcs(td, metadata)
+        self.finished_units = set()
+        self.stopped_early = False
+        early_stop = (self.owner_srcs and
+                      util.get_setting('rust_syntax_checking_early_stop',
+                                       False))
+        if early_stop:
+            json_reasons = rust_proc.DIAGNOSTIC_REASONS + ('compiler-artifact',)
+        else:
+            json_reasons = rust_proc.DIAGNOSTIC_REASONS
+        combine = (
+            len(targets) > 1 and
+            util.get_setting('rust_syntax_checking_combine_targets', True))
+        if combine:
+            # Check all targets with one Cargo process.  Messages are
+            # attributed to their target with the `target` field of each
+            # message.  Targets with their own project settings are still
+            # checked separately, since the settings are looked up by the
+            # target arguments.
+            separate = [t for t in targets
+                        if settings.has_project_package_target(
+                            self.cwd, ' '.join(t[1]))]
+            combined = [t for t in targets if t not in separate]
+            targets = separate
+            if len(combined) > 1:
+                targets.append((None, [arg for _, target_args in combined
+                                       for arg in target_args]))
+            else:
+                targets.extend(combined)
+        package_args = []
+        package = None
+        if util.get_setting('rust_syntax_checking_package_scoped', True):
+            # Only check the workspace member that owns the file.
+            package = td.find_package(self.triggered_file_name, metadata)
+            if package:
+                package_args = ['-p', package['name']]
+        initial_settings = {}
+        target_dir = self.get_target_dir(metadata)
+        if target_dir:
+            # Avoid waiting on the lock of the regular target directory.
+            initial_settings['env'] = {'CARGO_TARGET_DIR': target_dir}
         rc = 0
         for (target_src, target_args) in targets:
-            cmd = settings.get_command(method, command_info, self.cwd, self.cwd,
-                initial_settings={'target': ' '.join(target_args)},
-                force_json=True, metadata=metadata)
-            self.msg_rel_path = cmd['msg_rel_path']
-            if (util.get_setting('rust_syntax_checking_include_tests', True) and
-                semver.match(cmd['rustc_version'], '>=1.23.0')):
-                # Including the test harness has a few drawbacks.
-                # missing_docs lint is disabled (see
-                # https://github.com/rust-lang/sublime-rust/issues/156)
-                # It also disables the "main function not found" error for
-                # binaries.
-                cmd['command'].append('--profile=test')
-            p = rust_proc.RustProc()
-            self.current_target_src = target_src
-            p.run(self.window, cmd['command'], self.cwd, self, env=cmd['env'])
-            rc = p.wait()
+            self.combined_targets = combine and target_src is None
+            try:
+                rc = self._run_check(method, command_info, settings, metadata,
+                                     initial_settings, target_src, target_args,
+                                     json_reasons, package_args)
+            except rust_proc.ProcessTerminatedError:
+                if self.should_exit or not self.stopped_early:
+                    raise
+                log.log(self.window, 'On-save check stopped, all targets '
+                        'containing the file are done.')
+                rc = 0
+                break
             if self.this_view_found:
-                return rc
+                break
+
+        if (package and not rc and
+                util.get_setting('rust_syntax_checking_dependents', False)):
+            # Second pass for the members that depend on this one.
+            dependents = td.reverse_dependents(package['name'], metadata)
+            if dependents:
+                log.log(self.window, 'Checking dependents: %s',
+                        ', '.join(dependents))
+                package_args = []
+                for name in dependents:
+                    package_args.extend(['-p', name])
+                self.owner_srcs = set()
+                self.combined_targets = True
+                rc = self._run_check(method, command_info, settings, metadata,
+                                     initial_settings, None, [],
+                                     rust_proc.DIAGNOSTIC_REASONS,
+                                     package_args)
         return rc
 
+    def get_target_dir(self, metadata):
+        """Returns the CARGO_TARGET_DIR to use, or None for the default."""
+        return check_target.get_check_target_dir(metadata, self.cwd)
+
+    def _run_check(self, method, command_info, settings, metadata,
+                   initial_settings, target_src, target_args, json_reasons,
+                   package_args=()):
+        """Run Cargo for the given target arguments.
+
+        :param package_args: Arguments selecting the packages (such as
+            `-p NAME`).  Kept out of the target so that per-target project
+            settings still apply.
+
+        :raises rust_proc.ProcessTerminatedError: Check was canceled or
+            stopped early.
+
+        :returns: Returns the process return code.
+        """
+        initial_settings = dict(initial_settings,
+                                target=' '.join(target_args))
+        cmd = settings.get_command(method, command_info, self.cwd, self.cwd,
+            initial_settings=initial_settings,
+            force_json=True, metadata=metadata)
+        if package_args:
+            i = cmd['command'].index(command_info['command']) + 1
+            cmd['command'][i:i] = package_args
+        self.msg_rel_path = cmd['msg_rel_path']
+        if (util.get_setting('rust_syntax_checking_include_tests', True) and
+            versions.has_capability(cmd['rustc_version'],
+                                    'check_test_profile')):
+            # Including the test harness has a few drawbacks.
+            # missing_docs lint is disabled (see
+            # https://github.com/rust-lang/sublime-rust/issues/156)
+            # It also disables the "main function not found" error for
+            # binaries.
+            cmd['command'].append('--profile=test')
+        self.test_profile = '--profile=test' in cmd['command']
+        p = rust_proc.RustProc()
+        self.current_target_src = target_src
+        p.run(self.window, cmd['command'], self.run_cwd or self.cwd, self,
+              env=cmd['env'], json_reasons=json_reasons, tag=method)
+        return p.wait()
+
     #########################################################################
     # ProcListner methods
     #########################################################################
@@ -199,14 +453,278 @@ class RustSyntaxCheckThread(rust_thread.RustThread, rust_proc.ProcListener):
         log.critical(self.window, 'Rust Error: %s', message)
 
     def on_json(self, proc, obj):
+        if obj.get('reason') == 'compiler-artifact':
+            self._on_artifact(proc, obj)
+            return
+        target_src = self.current_target_src
+        if self.combined_targets:
+            src_path = obj.get('target', {}).get('src_path')
+            if src_path:
+                target_src = os.path.normpath(src_path)
         messages.add_rust_messages(self.window, self.msg_rel_path, obj,
-                                   self.current_target_src, msg_cb=None)
+                                   target_src, msg_cb=None)
         if messages.has_message_for_path(self.window,
                                          self.triggered_file_name):
             self.this_view_found = True
 
-    def on_finished(self, proc, rc):
+    def _on_artifact(self, proc, obj):
+        # Cargo emits all messages of a target before its artifact, so at
+        # this point the target's messages are complete.
+        target = obj.get('target', {})
+        src_path = target.get('src_path')
+        if not src_path:
+            return
+        src_path = os.path.normpath(src_path)
+        if 'custom-build' in target.get('kind', ()):
+            # Build scripts are only built once, without the test harness.
+            test = self.test_profile
+        else:
+            test = bool(obj.get('profile', {}).get('test'))
+        self.finished_units.add((src_path, test))
+        if (self.owner_srcs and not self.stopped_early and
+                all(self._owner_done(src) for src in self.owner_srcs)):
+            self.stopped_early = True
+            proc.terminate()
+
+    def _owner_done(self, src_path):
+        """Whether or not the unit (for the profile in use) of a target
+        containing the triggered file has finished."""
+        return (src_path, self.test_profile) in self.finished_units
+
+    def _root_srcs(self, td, metadata):
+        """Returns the set of `src_path` of the targets of the triggered
+        file's package whose root is the triggered file."""
+        package = td.find_package(self.triggered_file_name, metadata)
+        if package is None:
+            return set()
+        root_path = os.path.dirname(package['manifest_path'])
+        result = set()
+        for target in package['targets']:
+            src_path = os.path.normpath(os.path.join(root_path,
+                                                     target['src_path']))
+            if src_path == self.triggered_file_name:
+                result.add(src_path)
+        return result
+
+    def on_finished(self, proc, rc, usage):
         log.log(self.window, 'On-save check finished.')
 
     def on_terminated(self, proc):
         log.log(self.window, 'Process Interrupted')
+
+
+class RustLiveCheckEvent(sublime_plugin.EventListener):
+
+    """Checks unsaved changes while typing, if `rust_live_check` is
+    enabled."""
+
+    # Map window ID to a counter incremented by each modification, used for
+    # debouncing.
+    tokens = {}
+
+    def on_modified_async(self, view):
+        if not util.get_setting('rust_live_check', False):
+            return
+        if not util.active_view_is_rust(view=view):
+            return
+        window = view.window()
+        if window is None:
+            return
+        token = self.tokens.get(window.id(), 0) + 1
+        self.tokens[window.id()] = token
+        delay = util.get_setting('rust_live_check_delay', 1000)
+        sublime.set_timeout_async(lambda: self._check(view, token), delay)
+
+    def _check(self, view, token):
+        window = view.window()
+        if window is None or self.tokens.get(window.id()) != token:
+            return
+        if not view.is_dirty():
+            # The on-save check handles saved files.
+            return
+        t = RustLiveCheckThread(view)
+        t.start()
+
+
+class RustLiveCheckThread(RustSyntaxCheckThread):
+
+    """Checks the workspace with the contents of unsaved buffers, using a
+    shadow copy of the workspace (see the `shadow` module)."""
+
+    name = 'Live Check'
+    priority = rust_thread.PRIORITY_BACKGROUND
+    # ShadowTree for the workspace.
+    shadow = None
+
+    def get_rustc_messages(self):
+        metadata = util.get_cargo_metadata(self.window, self.cwd)
+        if not metadata:
+            return -1
+        root = metadata.get('workspace_root') or self.cwd
+        self.shadow = shadow.get_shadow(root)
+        self.shadow.sync(self.window, self._dirty_buffers(root))
+        self.run_cwd = self.shadow.to_shadow(self.cwd)
+        return super(RustLiveCheckThread, self).get_rustc_messages()
+
+    def get_target_dir(self, metadata):
+        # Keep separate from both builds and on-save checks.
+        return self.shadow.target_dir
+
+    def _dirty_buffers(self, root):
+        buffers = {}
+        for view in self.window.views():
+            file_name = view.file_name()
+            if not file_name or not view.is_dirty():
+                continue
+            path = os.path.abspath(file_name)
+            if path.startswith(os.path.join(root, '')):
+                buffers[path] = view.substr(sublime.Region(0, view.size()))
+        return buffers
+
+    def on_json(self, proc, obj):
+        self.shadow.map_message(obj)
+        super(RustLiveCheckThread, self).on_json(proc, obj)
+
+
+# Map workspace root to a Watcher.
+WATCHERS = {}
+
+
+class RustWatchEvent(sublime_plugin.EventListener):
+
+    """Starts a watcher for the workspace of each Rust file that is opened,
+    if `rust_watch_external_changes` is enabled."""
+
+    def on_activated_async(self, view):
+        if not util.get_setting('rust_watch_external_changes', False):
+            return
+        if not util.active_view_is_rust(view=view):
+            return
+        window = view.window()
+        if window is None:
+            return
+        cwd = util.find_cargo_manifest(view.file_name())
+        if cwd is None:
+            return
+        metadata = util.get_cargo_metadata(window, cwd)
+        root = (metadata or {}).get('workspace_root') or cwd
+        if root in WATCHERS:
+            return
+        w = watcher.Watcher(root,
+            lambda paths: _on_external_change(root, paths),
+            delay=util.get_setting('rust_watch_delay', 500) / 1000,
+            poll_interval=util.get_setting('rust_watch_poll_interval',
+                                           2000) / 1000,
+            window=window)
+        WATCHERS[root] = w
+        w.start()
+        log.log(window, 'Watching %s for external changes.', root)
+
+    def on_pre_close_window(self, window):
+        for root in list(WATCHERS):
+            if _window_for_root(root, exclude=window) is None:
+                _stop_watcher(root)
+
+
+def _holds_root(window, root):
+    """Whether or not the window has a folder or file in the workspace."""
+    prefix = os.path.join(root, '')
+    for folder in window.folders():
+        if folder == root or folder.startswith(prefix):
+            return True
+    for view in window.views():
+        file_name = view.file_name()
+        if file_name and file_name.startswith(prefix):
+            return True
+    return False
+
+
+def _window_for_root(root, exclude=None):
+    """Returns the window (preferably the active one) that has the given
+    workspace open, or None."""
+    windows = sublime.windows()
+    active = sublime.active_window()
+    if active in windows:
+        windows.remove(active)
+        windows.insert(0, active)
+    for window in windows:
+        if exclude is not None and window.id() == exclude.id():
+            continue
+        if _holds_root(window, root):
+            return window
+    return None
+
+
+def _stop_watcher(root):
+    w = WATCHERS.pop(root, None)
+    if w is not None:
+        w.stop()
+        log.log(w.window, 'Stopped watching %s.', root)
+
+
+def _update_watchers():
+    """Called when settings change."""
+    if not util.get_setting('rust_watch_external_changes', False):
+        for root in list(WATCHERS):
+            _stop_watcher(root)
+
+
+def _on_external_change(root, paths):
+    # Windows may have been opened or closed since the watcher started.
+    window = _window_for_root(root)
+    if (window is None or not util.get_setting('rust_watch_external_changes',
+                                               False, window=window)):
+        _stop_watcher(root)
+        return
+    changed = []
+    for path in paths:
+        state = CHECK_STATES.get((window.id(), util.find_cargo_manifest(path)))
+        if (state is not None and path in state.hashes and
+                state.hashes[path] == _hash_file(path)):
+            # Already checked (typically saved from Sublime).
+            continue
+        changed.append(path)
+    if not changed:
+        return
+    changed.sort()
+    log.log(window, 'External changes: %s', ', '.join(changed))
+    rs_files = [path for path in changed if path.endswith('.rs')]
+    if rs_files:
+        file_name = rs_files[0]
+    elif changed[0] == root:
+        file_name = os.path.join(root, 'Cargo.toml')
+    else:
+        file_name = changed[0]
+    t = RustExternalCheckThread(window, file_name)
+    t.start()
+
+
+class RustExternalCheckThread(RustSyntaxCheckThread):
+
+    """Check triggered by a file changed outside of Sublime."""
+
+    name = 'External Change Check'
+    priority = rust_thread.PRIORITY_BACKGROUND
+
+    def __init__(self, window, file_name):
+        self.view = None
+        self.window = window
+        self.triggered_file_name = file_name
+        rust_thread.RustThread.__init__(self, window)
+
+
+def plugin_loaded():
+    for name in util.SETTINGS_FILES:
+        sublime.load_settings(name).add_on_change('rust_watch',
+                                                  _update_watchers)
+        sublime.load_settings(name).add_on_change('rust_check_states',
+                                                  _settings_changed)
+
+
+def plugin_unloaded():
+    for name in util.SETTINGS_FILES:
+        sublime.load_settings(name).clear_on_change('rust_watch')
+        sublime.load_settings(name).clear_on_change('rust_check_states')
+    for w in WATCHERS.values():
+        w.stop()
+    WATCHERS.clear()
@@ -1,19 +1,21 @@
 """Sublime commands for the cargo build system."""
 
 import functools
+import json
 import sublime
 import sublime_plugin
 import sys
 from .rust import (rust_proc, rust_thread, opanel, util, messages,
-                   cargo_settings, target_detect)
+                   cargo_settings, target_detect, shell_env)
 from .rust.cargo_config import *
 from .rust.log import (log, clear_log, RustOpenLog, RustLogEvent)
+from .rust.shell_env import RustClearShellEnvCacheCommand
+from .rust.check_target import RustPruneCheckTargetDirCommand
 
 # Maps command to an input string. Used to pre-populate the input panel with
 # the last entered value.
 LAST_EXTRA_ARGS = {}
 
-
 class CargoExecCommand(sublime_plugin.WindowCommand):
 
     """cargo_exec Sublime command.
@@ -178,6 +180,7 @@ class CargoExecCommand(sublime_plugin.WindowCommand):
 class CargoExecThread(rust_thread.RustThread):
 
     silently_interruptible = False
+    priority = rust_thread.PRIORITY_INTERACTIVE
     name = 'Cargo Exec'
 
     def __init__(self, window, settings,
@@ -191,6 +194,13 @@ class CargoExecThread(rust_thread.RustThread):
         self.settings_path = settings_path
         self.working_dir = working_dir
 
+    def job_key(self):
+        # Only identical commands are merged, so that a pending build is not
+        # replaced by a test.
+        return (self.__class__.__name__, self.command_name,
+                self.settings_path, self.working_dir,
+                json.dumps(self.initial_settings, sort_keys=True, default=str))
+
     def run(self):
         cmd = self.settings.get_command(self.command_name,
                                         self.command_info,
@@ -211,7 +221,9 @@ class CargoExecThread(rust_thread.RustThread):
                   self.working_dir, listener,
                   env=cmd['env'],
                   decode_json=decode_json,
-                  json_stop_pattern=self.command_info.get('json_stop_pattern'))
+                  json_stop_pattern=self.command_info.get('json_stop_pattern'),
+                  json_reasons=rust_proc.DIAGNOSTIC_REASONS,
+                  tag=self.command_name)
             p.wait()
         except rust_proc.ProcessTerminatedError:
             return
@@ -266,13 +278,19 @@ class RustPrevMessageCommand(NextPrevBase):
 
 class RustCancelCommand(sublime_plugin.WindowCommand):
 
-    def run(self):
-        try:
-            t = rust_thread.THREADS[self.window.id()]
-        except KeyError:
-            pass
-        else:
-            t.terminate()
+    """rust_cancel Sublime command.
+
+    This takes the following arguments:
+
+    - `tag`: If set, only cancel processes with this tag (such as "check").
+      Otherwise, stops the running thread and all processes in the window.
+    """
+
+    def run(self, tag=None):
+        if tag is None:
+            rust_thread.get_scheduler(self.window).cancel()
+        # Kill anything else (such as processes not started by a thread).
+        rust_proc.terminate_procs(self.window, tag=tag)
         # Also call Sublime's cancel command, in case the user is using a
         # normal Sublime build.
         self.window.run_command('cancel_build')
@@ -468,10 +486,6 @@ class CargoMessageHover(sublime_plugin.ViewEventListener):
 
     """Displays a popup if `rust_phantom_style` is "popup" when the mouse
     hovers over a message region.
-
-    Limitation:  If you edit the file and shift the region, the hover feature
-    will not recognize the new region.  This means that the popup will only
-    show in the old location.
     """
 
     @classmethod
@@ -487,6 +501,81 @@ class CargoMessageHover(sublime_plugin.ViewEventListener):
             messages.message_popup(self.view, point, hover_zone)
 
 
+if hasattr(sublime_plugin, 'TextChangeListener'):
+    # Sublime 4 only.  On Sublime 3 the message index is rebuilt after every
+    # edit.
+    class RustMessageIndexListener(sublime_plugin.TextChangeListener):
+
+        """Keeps the message index of a file in step with edits, so hover
+        and status bar lookups stay fast."""
+
+        @classmethod
+        def is_applicable(cls, buffer):
+            view = buffer.primary_view()
+            return view is not None and util.is_rust_view(view.settings())
+
+        def on_text_changed(self, changes):
+            view = self.buffer.primary_view()
+            if view is not None:
+                messages.text_changed(view, changes)
+
+
+class RustLazyPhantomListener(sublime_plugin.ViewEventListener):
+
+    """Shows the phantoms near the visible area as the view scrolls, with the
+    `rust_phantom_lazy` setting.
+
+    Sublime does not have a scroll event, so the active view is polled.
+    """
+
+    @classmethod
+    def is_applicable(cls, settings):
+        # The setting is checked when polling, since this is not re-evaluated
+        # when the setting changes.
+        return util.is_rust_view(settings)
+
+    @classmethod
+    def applies_to_primary_view_only(cls):
+        return False
+
+    def on_activated(self):
+        if util.get_setting('rust_phantom_lazy', False):
+            _start_lazy_poll(self.view)
+
+
+# Milliseconds between checks of the visible area with `rust_phantom_lazy`.
+LAZY_POLL_INTERVAL = 250
+# Set of IDs of views being polled.
+LAZY_POLLING = set()
+
+
+def _start_lazy_poll(view):
+    if view.id() not in LAZY_POLLING:
+        LAZY_POLLING.add(view.id())
+        _lazy_poll(view)
+
+
+def _lazy_poll(view):
+    window = view.window()
+    if (window is None or window.active_view() != view or
+            not util.get_setting('rust_phantom_lazy', False)):
+        LAZY_POLLING.discard(view.id())
+        return
+    messages.update_lazy_phantoms(view)
+    sublime.set_timeout(lambda: _lazy_poll(view), LAZY_POLL_INTERVAL)
+
+
+def _lazy_setting_changed():
+    """Start polling the active views when `rust_phantom_lazy` is turned
+    on, since they will not be activated again."""
+    if not util.get_setting('rust_phantom_lazy', False):
+        return
+    for window in sublime.windows():
+        view = window.active_view()
+        if view is not None and util.active_view_is_rust(view=view):
+            _start_lazy_poll(view)
+
+
 class RustMessagePopupCommand(sublime_plugin.TextCommand):
 
     """Manually display a popup for any message under the cursor."""
@@ -539,12 +628,15 @@ class RustEventListener(sublime_plugin.EventListener):
         # Use set_timeout to give it time to attach to a window.
         sublime.set_timeout(activate, 1)
 
+    def on_pre_close(self, view):
+        messages.view_pre_close(view)
+
     def on_query_context(self, view, key, operator, operand, match_all):
         # Used by the Escape-key keybinding to dismiss inline phantoms.
         if key == 'rust_has_messages':
             try:
-                winfo = messages.WINDOW_MESSAGES[view.window().id()]
-                has_messages = not winfo['hidden']
+                store = messages.WINDOW_MESSAGES[view.window().id()]
+                has_messages = not store.hidden
             except KeyError:
                 has_messages = False
             if operator == sublime.OP_EQUAL:
@@ -578,6 +670,9 @@ class RustScrollToRegion(sublime_plugin.TextCommand):
 
 def plugin_unloaded():
     messages.clear_all_messages()
+    for name in util.SETTINGS_FILES:
+        sublime.load_settings(name).clear_on_change('rust_proc_env')
+        sublime.load_settings(name).clear_on_change('rust_phantom_lazy')
     try:
         from package_control import events
     except ImportError:
@@ -597,6 +692,18 @@ def plugin_unloaded():
 
 
 def plugin_loaded():
+    # Rebuild the child process environment, and start polling for lazy
+    # phantoms, when settings change.
+    for name in util.SETTINGS_FILES:
+        sublime.load_settings(name).add_on_change('rust_proc_env',
+                                                  rust_proc.invalidate_env)
+        sublime.load_settings(name).add_on_change('rust_phantom_lazy',
+                                                  _lazy_setting_changed)
+    _lazy_setting_changed()
+    if util.get_setting('rust_include_shell_env', True):
+        # Load the environment now so the first build does not have to wait
+        # for the login shell.
+        shell_env.refresh_async()
     try:
         from package_control import events
     except ImportError:
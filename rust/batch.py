@@ -38,6 +38,8 @@ class MessageBatch:
         raise NotImplementedError()
 
     def _dismiss(self, window):
+        # Defer cyclic import.
+        from . import messages
         # There is a awkward problem with Sublime and
         # add_regions/erase_regions. The regions are part of the undo stack,
         # which means even after we erase them, they can come back from the
@@ -53,7 +55,7 @@ class MessageBatch:
             views = util.open_views_for_file(window, msg.path)
             for view in views:
                 view.erase_regions(msg.region_key)
-                view.erase_phantoms(msg.region_key)
+                messages.discard_phantom(view, msg.region_key)
 
 
 class PrimaryBatch(MessageBatch):
@@ -94,6 +96,9 @@ class PrimaryBatch(MessageBatch):
         self._dismiss(window)
         for batch in self.child_batches:
             batch._dismiss(window)
+        # Defer cyclic import.
+        from . import messages
+        messages.flush_phantoms()
 
 
 class ChildBatch(MessageBatch):
@@ -128,3 +133,6 @@ class ChildBatch(MessageBatch):
     def dismiss(self, window):
         self.hidden = True
         self._dismiss(window)
+        # Defer cyclic import.
+        from . import messages
+        messages.flush_phantoms()
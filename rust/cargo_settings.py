@@ -240,6 +240,16 @@ class CargoSettings(object):
                                 .get(target, {})\
                                 .get(key, default)
 
+    def has_project_package_target(self, path, target):
+        """Whether or not there are any settings for the given target."""
+        path = os.path.normpath(path)
+        return bool(self.project_data.get('settings', {})
+                                     .get('cargo_build', {})
+                                     .get('paths', {})
+                                     .get(path, {})
+                                     .get('targets', {})
+                                     .get(target))
+
     def set_project_package_target(self, path, target, key, value):
         path = os.path.normpath(path)
         self.project_data.setdefault('settings', {})\
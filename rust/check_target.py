@@ -0,0 +1,138 @@
+"""Separate Cargo target directory for on-save checks.
+
+Cargo locks the target directory while it runs, so an on-save check started
+during a build waits for the build to finish (and vice-versa).  The
+`rust_syntax_checking_target_dir` setting gives the checks their own target
+directory, which avoids the lock at the cost of extra disk space.
+"""
+
+import os
+import shutil
+import threading
+import time
+import sublime
+import sublime_plugin
+
+from . import util, log, rust_proc, rust_thread
+
+# Number of seconds to wait for running checks to exit before deleting their
+# target directory.
+STOP_TIMEOUT = 10
+
+
+def get_check_target_dir(metadata, cwd):
+    """Returns the absolute path of the target directory for on-save checks,
+    or None to use Cargo's default.
+
+    :param metadata: Output from `get_cargo_metadata` (or None).
+    :param cwd: The directory where Cargo is run.
+    """
+    target_dir = util.get_setting('rust_syntax_checking_target_dir')
+    if not target_dir:
+        return None
+    target_dir = os.path.expanduser(os.path.expandvars(target_dir))
+    if os.path.isabs(target_dir):
+        return target_dir
+    if metadata and metadata.get('workspace_root'):
+        base = metadata['workspace_root']
+    else:
+        base = cwd
+    return os.path.normpath(os.path.join(base, target_dir))
+
+
+def disk_usage(path):
+    """Returns the number of bytes used by all files under path."""
+    total = 0
+    for dirpath, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _window_check_target_dirs(window):
+    """Returns the check target directories of the packages open in the
+    window that exist on disk."""
+    paths = list(window.folders())
+    view = window.active_view()
+    if view and view.file_name():
+        paths.append(os.path.dirname(view.file_name()))
+    result = []
+    for path in paths:
+        manifest_dir = util.find_cargo_manifest(path)
+        if not manifest_dir:
+            continue
+        metadata = util.get_cargo_metadata(window, manifest_dir)
+        target_dir = get_check_target_dir(metadata, manifest_dir)
+        if target_dir and os.path.isdir(target_dir) and \
+                target_dir not in result:
+            result.append(target_dir)
+    return result
+
+
+class RustPruneCheckTargetDirCommand(sublime_plugin.WindowCommand):
+
+    """Reports the disk space used by the on-save check target directories,
+    and offers to delete them."""
+
+    def is_enabled(self):
+        return bool(util.get_setting('rust_syntax_checking_target_dir'))
+
+    def run(self):
+        t = threading.Thread(target=self._run, name='Rust Prune Check Dir')
+        t.start()
+
+    def _run(self):
+        target_dirs = _window_check_target_dirs(self.window)
+        if not target_dirs:
+            sublime.message_dialog(
+                'Rust Enhanced: No on-save check target directories found.')
+            return
+        sizes = [(path, disk_usage(path)) for path in target_dirs]
+        total = sum(size for _, size in sizes)
+        lines = ['%s: %.1f MB' % (path, size / 1048576)
+                 for path, size in sizes]
+        msg = util.multiline_fix("""
+            Rust Enhanced
+
+            On-save check target directories use %.1f MB:
+            %s
+
+            Delete them?  They are rebuilt by the next check.""") % (
+            total / 1048576, '\n'.join(lines))
+        if not sublime.ok_cancel_dialog(msg, 'Delete'):
+            return
+        if not self._stop_checks():
+            sublime.error_message(
+                'Rust Enhanced: A check is still running, try again later.')
+            return
+        for path in target_dirs:
+            log.log(self.window, 'Removing %s', path)
+            shutil.rmtree(path, ignore_errors=True)
+        self.window.status_message('Rust: Removed %.1f MB' % (
+            total / 1048576,))
+
+    def _stop_checks(self):
+        """Stop the checks (which may be using the directories) in every
+        window, and wait for them to exit.
+
+        :returns: False if a check did not exit in time.
+        """
+        threads = []
+        for window in sublime.windows():
+            scheduler = rust_thread.get_scheduler(window)
+            t = scheduler.cancel(max_priority=rust_thread.PRIORITY_CHECK)
+            if t is not None:
+                threads.append(t)
+            # Processes not started by a thread.
+            rust_proc.terminate_procs(window, tag=util.get_setting(
+                'rust_syntax_checking_method', 'check'))
+        deadline = time.time() + STOP_TIMEOUT
+        for t in threads:
+            t.join(max(0, deadline - time.time()))
+            if t.is_alive():
+                log.log(self.window, 'Prune: %s did not exit.', t.name)
+                return False
+        return True
@@ -9,24 +9,33 @@ import itertools
 import os
 import re
 import textwrap
+import threading
 import urllib.parse
 import uuid
 import webbrowser
 
 from . import util, themes, log
 from .batch import *
+from .region_index import RegionIndex
 from .levels import *
 
-# Key is window id.
-# Value is a dictionary: {
-#     'paths': {path: [MessageBatch, ...]},
-#     'batch_index': (path_idx, message_idx),
-#     'hidden': bool
-# }
-# `paths` is an OrderedDict to handle next/prev message.
-# `path` is the absolute path to the file.
-# `hidden` indicates that all messages have been dismissed.
+# Key is window id, value is a `MessageStore`.
 WINDOW_MESSAGES = {}
+# Key is window id, value is incremented each time the window's messages are
+# cleared.  See `generation`.
+WINDOW_GENERATIONS = {}
+# Key is buffer id, value is a `_LazyPhantoms`.  Only used with the
+# `rust_phantom_lazy` setting.
+LAZY_PHANTOMS = {}
+# Key is buffer id, value is a `PhantomManager`.  Phantoms are attached to
+# the buffer, so views into the same buffer share one manager.
+PHANTOM_MANAGERS = {}
+PHANTOM_MANAGERS_LOCK = threading.Lock()
+# Milliseconds to wait to collect phantoms from messages as they arrive
+# before displaying them.
+PHANTOM_FLUSH_DELAY = 100
+# True while a call to `flush_phantoms` is scheduled.
+PHANTOM_FLUSH_PENDING = False
 
 
 LINK_PATTERN = r'(https?://[-a-zA-Z0-9@:%._+~#=]{2,256}\.[a-zA-Z]{2,6}\b[-a-zA-Z0-9@:%_+.~#?&/=]*)'
@@ -59,6 +68,8 @@ class Message:
     :iver hidden: If true, don't show this message.
     :ivar suggested_replacement: An optional string of text as a suggestion to
         replace at the given span.  If this is set, `text` will NOT be set.
+    :ivar duplicate_children: Number of child messages that were skipped
+        because they were the same as another child.
     """
     region_key = None
     text = None
@@ -71,10 +82,13 @@ class Message:
     parent = None
     hidden = False
     suggested_replacement = None
+    duplicate_children = 0
 
     def __init__(self):
         self.id = uuid.uuid4()
         self.children = []
+        # Fingerprints of `children`, for deduplication.
+        self._child_fingerprints = set()
 
     def lineno(self, first=False):
         """Return the line number of the message (0-based).
@@ -168,15 +182,30 @@ class Message:
                 count += 1
         return count
 
+    def fingerprint(self):
+        """Returns a hashable value of the parts of the message used for
+        deduplication."""
+        return (self.path, self.span, self.level, self.text,
+                self.suggested_replacement)
+
     def is_similar(self, other):
         """Returns True if this message is essentially the same as the given
         message.  Used for deduplication."""
-        keys = ('path', 'span', 'level', 'text', 'suggested_replacement')
-        for key in keys:
-            if getattr(other, key) != getattr(self, key):
-                return False
-        else:
-            return True
+        return self.fingerprint() == other.fingerprint()
+
+    def add_child(self, child):
+        """Add a child message, unless it is the same as an existing child.
+
+        :returns: True if the child was added.
+        """
+        fingerprint = child.fingerprint()
+        if fingerprint in self._child_fingerprints:
+            self.duplicate_children += 1
+            return False
+        self._child_fingerprints.add(fingerprint)
+        child.parent = self
+        self.children.append(child)
+        return True
 
     def sublime_region(self, view):
         """Returns a sublime.Region object for this message."""
@@ -208,6 +237,212 @@ class Message:
         return ''.join(result)
 
 
+class MessageStore(object):
+
+    """The messages of a window.
+
+    :ivar paths: OrderedDict of `{path: [MessageBatch, ...]}`.  Ordered to
+        handle next/prev message.  `path` is the absolute path to the file.
+    :ivar batch_index: Position in `navigation().entries` of the current
+        message for next/prev, -1 if there is none.
+    :ivar hidden: True if all messages have been dismissed.
+    :ivar duplicates: Counter of messages that were skipped because they were
+        the same as another message.  Keys are 'messages' for primary
+        messages and 'children' for child messages.
+    """
+
+    def __init__(self):
+        self.paths = collections.OrderedDict()
+        self.batch_index = -1
+        self.hidden = False
+        self.duplicates = collections.Counter()
+        # Fingerprints of all primary messages, for deduplication.
+        self._fingerprints = set()
+        # Map path to a `_PathIndex`, built when first needed.
+        self._indexes = {}
+        # Map path to the number of region keys handed out.
+        self._region_keys = {}
+        # `_Navigation`, built when first needed.
+        self._navigation = None
+
+    def batches(self, path):
+        """Returns the list of batches for the given path."""
+        return self.paths.get(path, [])
+
+    def is_duplicate(self, primary_message):
+        """Returns True if an equivalent primary message is already stored."""
+        return primary_message.fingerprint() in self._fingerprints
+
+    def add_batch(self, batch):
+        """Add a batch, and give each of its messages a region key."""
+        path = batch.path()
+        if isinstance(batch, PrimaryBatch):
+            self._fingerprints.add(batch.primary_message.fingerprint())
+        # Region keys are unique per file.
+        num = self._region_keys.get(path, 0)
+        for msg in batch:
+            msg.region_key = 'rust-%i' % (num,)
+            num += 1
+        self._region_keys[path] = num
+        self.paths.setdefault(path, []).append(batch)
+        self._indexes.pop(path, None)
+        self._navigation = None
+
+    def set_paths(self, paths):
+        """Replace all batches (such as after sorting)."""
+        self.paths = paths
+        self._indexes.clear()
+        self._navigation = None
+
+    def navigation(self):
+        """Returns the `_Navigation` of all batches, building it if
+        needed."""
+        if self._navigation is None:
+            self._navigation = _Navigation(self.paths)
+        return self._navigation
+
+    def region_index(self, view):
+        """Returns the `_PathIndex` for the file in the view, building it if
+        needed."""
+        path = view.file_name()
+        index = self._indexes.get(path)
+        if (index is None or index.buffer_id != view.buffer_id() or
+                index.change_count != view.change_count()):
+            index = self._indexes[path] = _PathIndex(view, self.batches(path))
+        return index
+
+    def text_changed(self, view, changes):
+        """Update the index of the file in the view after an edit.
+
+        :param changes: List of `sublime.TextChange` objects.
+        """
+        index = self._indexes.get(view.file_name())
+        if index is None or index.buffer_id != view.buffer_id():
+            return
+        if not index.apply_changes(view, changes):
+            del self._indexes[view.file_name()]
+
+
+class _PathIndex(object):
+
+    """Index of the message regions in a file, used to find messages by point
+    or row without asking Sublime for the region of every message."""
+
+    def __init__(self, view, batches):
+        self.buffer_id = view.buffer_id()
+        # The index is rebuilt when this no longer matches the view, which
+        # happens if an edit was missed (Sublime 3 has no text change
+        # events).
+        self.change_count = view.change_count()
+        entries = []
+        for ordinal, batch in enumerate(batches):
+            for msg in batch:
+                region = msg.sublime_region(view)
+                entries.append((region.begin(), region.end(),
+                                (ordinal, batch, msg)))
+        self.regions = RegionIndex(entries)
+
+    def apply_changes(self, view, changes):
+        """Shift the regions for the given changes.
+
+        :returns: False if the index could not be updated and should be
+            rebuilt.
+        """
+        touched = set()
+        for change in changes:
+            touched.update(self.regions.apply_change(
+                change.a.pt, change.b.pt, len(change.str)))
+        # Sublime may move regions touching an edit in ways that are hard to
+        # predict, so read those back.
+        for i in sorted(touched):
+            _, _, msg = self.regions.payloads[i]
+            region = msg.sublime_region(view)
+            if not self.regions.set_region(i, region.begin(), region.end()):
+                return False
+        self.change_count = view.change_count()
+        return True
+
+    def batches(self, lo, hi, first_only=False):
+        """Returns the batches with messages overlapping the points lo to hi,
+        in the order they are stored.
+
+        :param first_only: Only consider the first message of each batch.
+        """
+        found = {}
+        for ordinal, batch, msg in self.regions.overlapping(lo, hi):
+            if batch.hidden or ordinal in found:
+                continue
+            if first_only:
+                if msg is not batch.first():
+                    continue
+            elif msg.hidden:
+                continue
+            found[ordinal] = batch
+        return [found[ordinal] for ordinal in sorted(found)]
+
+
+class _Navigation(object):
+
+    """Flat list of all batches in the order used for next/prev message and
+    the message list.
+
+    :ivar entries: List of `(path, batch)` tuples.
+    """
+
+    def __init__(self, paths):
+        self.entries = [(path, batch)
+                        for path, batches in paths.items()
+                        for batch in batches]
+        # Map the `levels` argument of next/prev to the list of positions
+        # in `entries` of the batches that match.
+        self._positions = {}
+        # Map `levels` to a list with the number of matching batches at or
+        # before each position in `entries`.
+        self._counts = {}
+        for levels in ('all', 'error', 'warning'):
+            positions = []
+            counts = []
+            for pos, (_, batch) in enumerate(self.entries):
+                if _is_matching_level(levels, batch.first()):
+                    positions.append(pos)
+                counts.append(len(positions))
+            self._positions[levels] = positions
+            self._counts[levels] = counts
+
+    def _step(self, levels, i, direction):
+        positions = self._positions[levels]
+        for n in range(len(positions)):
+            pos = positions[(i + n * direction) % len(positions)]
+            if not self.entries[pos][1].hidden:
+                return pos
+        return None
+
+    def next(self, levels, current):
+        """Returns the position of the next visible batch after `current`
+        (wrapping around), or None if there is none."""
+        if not self._positions[levels]:
+            return None
+        if 0 <= current < len(self.entries):
+            i = self._counts[levels][current]
+        else:
+            i = 0
+        return self._step(levels, i, 1)
+
+    def prev(self, levels, current):
+        """Returns the position of the previous visible batch before
+        `current` (wrapping around), or None if there is none."""
+        positions = self._positions[levels]
+        if not positions:
+            return None
+        if 0 <= current < len(self.entries):
+            i = self._counts[levels][current] - 1
+            if i >= 0 and positions[i] == current:
+                i -= 1
+        else:
+            i = len(positions) - 1
+        return self._step(levels, i, -1)
+
+
 def clear_messages(window, soft=False):
     """Remove all messages for the given window.
 
@@ -215,19 +450,32 @@ def clear_messages(window, soft=False):
         resurrected with various commands (such as list messages, or
         next/prev).
     """
+    WINDOW_GENERATIONS[window.id()] = generation(window) + 1
     if soft:
-        winfo = WINDOW_MESSAGES.get(window.id(), {})
-        winfo['hidden'] = True
+        store = WINDOW_MESSAGES.get(window.id())
+        if store is None:
+            return
+        store.hidden = True
     else:
-        winfo = WINDOW_MESSAGES.pop(window.id(), {})
+        store = WINDOW_MESSAGES.pop(window.id(), None)
+        if store is None:
+            return
 
-    for path, batches in winfo.get('paths', {}).items():
+    for path, batches in store.paths.items():
         views = util.open_views_for_file(window, path)
         for view in views:
+            LAZY_PHANTOMS.pop(view.buffer_id(), None)
+            discard_phantom_manager(view)
             for batch in batches:
                 for msg in batch:
                     view.erase_regions(msg.region_key)
-                    view.erase_phantoms(msg.region_key)
+
+
+def generation(window):
+    """Returns a number that changes whenever the messages of the window are
+    cleared.  This can be used to tell if the messages have been replaced
+    since some point in time."""
+    return WINDOW_GENERATIONS.get(window.id(), 0)
 
 
 def clear_all_messages():
@@ -247,13 +495,31 @@ def add_message(window, message):
 
 
 def has_message_for_path(window, path):
-    paths = WINDOW_MESSAGES.get(window.id(), {}).get('paths', {})
-    return path in paths
+    store = WINDOW_MESSAGES.get(window.id())
+    return store is not None and path in store.paths
 
 
 def messages_finished(window):
     """This should be called after all messages have been added."""
+    flush_phantoms()
     _sort_messages(window)
+    try:
+        store = WINDOW_MESSAGES[window.id()]
+    except KeyError:
+        store = None
+    if store is not None:
+        store.navigation()
+        if util.get_setting('rust_phantom_lazy', False):
+            # Phantoms were chosen in the order the compiler emitted the
+            # messages, so errors may have been left out by the limit.
+            for path in store.paths:
+                views = util.open_views_for_file(window, path)
+                if views:
+                    update_lazy_phantoms(views[0], force=True)
+    counts = duplicate_counts(window)
+    if any(counts.values()):
+        log.log(window, 'Skipped %i duplicate messages and %i duplicate '
+                'child messages.', counts['messages'], counts['children'])
 
 
 def _draw_region_highlights(view, batch):
@@ -303,38 +569,29 @@ def _draw_region_highlights(view, batch):
 def batches_at_point(view, point, hover_zone):
     """Return a list of message batches at the given point."""
     try:
-        winfo = WINDOW_MESSAGES[view.window().id()]
+        store = WINDOW_MESSAGES[view.window().id()]
     except KeyError:
         return
-    if winfo['hidden']:
-        return
-    batches = winfo['paths'].get(view.file_name(), [])
+    if store.hidden or view.file_name() not in store.paths:
+        return []
+    index = store.region_index(view)
 
     if hover_zone == sublime.HOVER_GUTTER:
         # Collect all messages on this line.
-        row = view.rowcol(point)[0]
-
-        def filter_row(batch):
-            if batch.hidden:
-                return False
-            region = batch.first().sublime_region(view)
-            batch_row_a = view.rowcol(region.begin())[0]
-            batch_row_b = view.rowcol(region.end())[0]
-            return row >= batch_row_a and row <= batch_row_b
-
-        batches = filter(filter_row, batches)
+        line = view.line(point)
+        return index.batches(line.begin(), line.end(), first_only=True)
     else:
         # Collect all messages covering this point.
-        def filter_point(batch):
-            if batch.hidden:
-                return False
-            for msg in batch:
-                if not msg.hidden and msg.sublime_region(view).contains(point):
-                    return True
-            return False
+        return index.batches(point, point)
+
 
-        batches = filter(filter_point, batches)
-    return list(batches)
+def text_changed(view, changes):
+    """Keep the message indexes of the file up to date after an edit.
+
+    :param changes: List of `sublime.TextChange` objects.
+    """
+    for store in WINDOW_MESSAGES.values():
+        store.text_changed(view, changes)
 
 
 def message_popup(view, point, hover_zone):
@@ -400,9 +657,10 @@ def _accept_replace(view, mid, replacement):
                 if str(msg.id) == mid:
                     return batch, msg
         raise ValueError('Rust Enhanced internal error: Could not find ID %r' % (mid,))
-    batches = WINDOW_MESSAGES.get(view.window().id(), {})\
-                             .get('paths', {})\
-                             .get(view.file_name(), [])
+    try:
+        batches = WINDOW_MESSAGES[view.window().id()].batches(view.file_name())
+    except KeyError:
+        batches = []
     batch, msg = batch_and_msg()
     # Retrieve the updated region from Sublime (since it may have changed
     # since the messages were generated).
@@ -419,17 +677,21 @@ def _accept_replace(view, mid, replacement):
     msg.hidden = True
     if msg.suggestion_count():
         # Additional suggestions still exist, re-render the phantom.
-        view.erase_phantoms(batch.first().region_key)
+        manager = get_phantom_manager(view)
+        manager.discard(batch.first().region_key)
         for m in batch:
             # Force `span` to be updated to the most recent value.
             m.sublime_region(view)
         _show_phantom(view, batch)
+        manager.flush()
     else:
         # No more suggestions, just hide the diagnostic completely.
         batch.primary().dismiss(view.window())
 
 
 def _show_phantom(view, batch):
+    """Set the phantom for a batch.  `PhantomManager.flush` must be called
+    to display it."""
     if util.get_setting('rust_phantom_style') != 'normal':
         return
     if batch.hidden:
@@ -454,23 +716,244 @@ def _show_phantom(view, batch):
     if not content:
         return
 
-    _sublime_add_phantom(
-        view,
-        first.region_key, region,
-        content,
-        sublime.LAYOUT_BLOCK,
-        functools.partial(_click_handler, view)
-    )
+    get_phantom_manager(view).set(first.region_key, region, content,
+        functools.partial(_click_handler, view))
+
+
+class PhantomManager(object):
+
+    """The message phantoms of a buffer, added through one of its views.
+
+    Phantoms are set and discarded by key (the region key of the first
+    message of the batch).  `flush` applies only the keys that changed since
+    the last flush, adding and erasing those phantoms one by one.
+    """
+
+    def __init__(self, view):
+        self.view = view
+        # Map key to `(region, content, on_navigate)` that should be shown.
+        self.phantoms = collections.OrderedDict()
+        # Map key to `(phantom_id, region, content, on_navigate)` of the
+        # phantoms currently shown.
+        self.shown = {}
+        # Keys that have changed since the last flush.
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def keys(self):
+        with self.lock:
+            return set(self.phantoms)
+
+    def set(self, key, region, content, on_navigate):
+        with self.lock:
+            old = self.phantoms.get(key)
+            if (old is not None and old[0] == region and
+                    old[1] == content):
+                return
+            self.phantoms[key] = (region, content, on_navigate)
+            self.pending.add(key)
+
+    def discard(self, key):
+        with self.lock:
+            if self.phantoms.pop(key, None) is not None:
+                self.pending.add(key)
+
+    def clear(self):
+        with self.lock:
+            self.pending.update(self.phantoms)
+            self.phantoms.clear()
+
+    def flush(self):
+        """Display the changes since the last flush."""
+        with self.lock:
+            pending = self.pending
+            self.pending = set()
+            for key in pending:
+                want = self.phantoms.get(key)
+                old = self.shown.get(key)
+                if old is not None:
+                    if want is not None and old[1:] == want:
+                        continue
+                    del self.shown[key]
+                    _sublime_erase_phantom(self.view, old[0])
+                if want is not None:
+                    region, content, on_navigate = want
+                    pid = _sublime_add_phantom(
+                        self.view, key, region, content,
+                        sublime.LAYOUT_BLOCK, on_navigate)
+                    self.shown[key] = (pid,) + want
+
+
+def get_phantom_manager(view):
+    """Returns the `PhantomManager` for the buffer of a view."""
+    with PHANTOM_MANAGERS_LOCK:
+        try:
+            return PHANTOM_MANAGERS[view.buffer_id()]
+        except KeyError:
+            manager = PHANTOM_MANAGERS[view.buffer_id()] = PhantomManager(view)
+            return manager
+
+
+def discard_phantom(view, key):
+    """Remove a phantom from a view.  It is removed from the display by the
+    next flush."""
+    with PHANTOM_MANAGERS_LOCK:
+        manager = PHANTOM_MANAGERS.get(view.buffer_id())
+    if manager is not None:
+        manager.discard(key)
+
+
+def discard_phantom_manager(view, erase=True):
+    """Forget about the phantoms of the buffer of a view.
+
+    :param erase: If True, remove the phantoms from the buffer.
+    """
+    with PHANTOM_MANAGERS_LOCK:
+        manager = PHANTOM_MANAGERS.pop(view.buffer_id(), None)
+    if manager is not None and erase:
+        manager.clear()
+        manager.flush()
+
+
+def view_pre_close(view):
+    """Called before a view is closed.
+
+    The phantoms of a buffer can only be updated through the view that owns
+    its `PhantomManager`.  If that view is closed while other views of the
+    buffer remain, the phantoms are erased and shown again through one of
+    the others.
+    """
+    with PHANTOM_MANAGERS_LOCK:
+        manager = PHANTOM_MANAGERS.get(view.buffer_id())
+    if manager is None or manager.view.id() != view.id():
+        return
+    window = view.window()
+    others = []
+    if window is not None and view.file_name():
+        others = [v for v in util.open_views_for_file(window, view.file_name())
+                  if v.id() != view.id()]
+    LAZY_PHANTOMS.pop(view.buffer_id(), None)
+    if others:
+        discard_phantom_manager(view)
+        other = others[0]
+        sublime.set_timeout(lambda: show_messages_for_view(other), 1)
+    else:
+        # The buffer is going away with the view.
+        discard_phantom_manager(view, erase=False)
+
+
+def flush_phantoms():
+    """Display the pending phantom changes of all views."""
+    global PHANTOM_FLUSH_PENDING
+    with PHANTOM_MANAGERS_LOCK:
+        PHANTOM_FLUSH_PENDING = False
+        managers = list(PHANTOM_MANAGERS.values())
+    for manager in managers:
+        manager.flush()
+
+
+def _schedule_flush_phantoms():
+    """Call `flush_phantoms` after a short delay, unless a call is already
+    scheduled."""
+    global PHANTOM_FLUSH_PENDING
+    with PHANTOM_MANAGERS_LOCK:
+        if PHANTOM_FLUSH_PENDING:
+            return
+        PHANTOM_FLUSH_PENDING = True
+    sublime.set_timeout(flush_phantoms, PHANTOM_FLUSH_DELAY)
+
+
+class _LazyPhantoms(object):
+
+    """The phantoms shown in a buffer with the `rust_phantom_lazy` setting.
+
+    :ivar rows: `(first_row, last_row)` range of rows phantoms were chosen
+        from.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def contains(self, row):
+        return self.rows[0] <= row <= self.rows[1]
+
+    def is_current(self, view, visible_rows):
+        """Whether or not the phantoms still cover the visible rows, with at
+        least half of the margin to spare."""
+        margin = util.get_setting('rust_phantom_lazy_margin', 100) // 2
+        last_row = view.rowcol(view.size())[0]
+        first, last = visible_rows
+        return ((first - margin >= self.rows[0] or self.rows[0] == 0) and
+                (last + margin <= self.rows[1] or self.rows[1] >= last_row))
+
+
+def _lazy_rows(view):
+    """Returns the `(first_row, last_row)` range of rows phantoms should be
+    shown for, and the currently visible rows."""
+    visible = view.visible_region()
+    first = view.rowcol(visible.begin())[0]
+    last = view.rowcol(visible.end())[0]
+    margin = util.get_setting('rust_phantom_lazy_margin', 100)
+    return (max(first - margin, 0), last + margin), (first, last)
+
+
+def _show_phantom_lazy(view, batch):
+    """Show the phantom for a new batch if it is close to the visible area
+    and the limit has not been reached."""
+    lazy = LAZY_PHANTOMS.get(view.buffer_id())
+    if lazy is None:
+        rows, _ = _lazy_rows(view)
+        lazy = LAZY_PHANTOMS[view.buffer_id()] = _LazyPhantoms(rows)
+    if len(get_phantom_manager(view).keys()) >= \
+            util.get_setting('rust_phantom_lazy_limit', 200):
+        return
+    row = view.rowcol(batch.first().sublime_region(view).begin())[0]
+    if lazy.contains(row):
+        _show_phantom(view, batch)
+
+
+def update_lazy_phantoms(view, force=False):
+    """Add and remove phantoms so that only those near the visible area are
+    shown.  Used with the `rust_phantom_lazy` setting as the view scrolls.
+
+    :param force: If True, update even if the visible area has not moved
+        far.
+    """
+    if util.get_setting('rust_phantom_style') != 'normal':
+        return
+    store = WINDOW_MESSAGES.get(view.window().id())
+    if store is None or store.hidden or view.file_name() not in store.paths:
+        return
+    rows, visible_rows = _lazy_rows(view)
+    lazy = LAZY_PHANTOMS.get(view.buffer_id())
+    if lazy is not None and not force and lazy.is_current(view, visible_rows):
+        return
+    lo = view.text_point(rows[0], 0)
+    hi = view.line(min(view.text_point(rows[1], 0), view.size())).end()
+    limit = util.get_setting('rust_phantom_lazy_limit', 200)
+    # Errors come first since the batches are sorted by level.
+    wanted = collections.OrderedDict(
+        (batch.first().region_key, batch)
+        for batch in store.region_index(view).batches(lo, hi, first_only=True)[:limit])
+    manager = get_phantom_manager(view)
+    shown = manager.keys()
+    for key in shown - set(wanted):
+        manager.discard(key)
+    for key, batch in wanted.items():
+        if key not in shown:
+            _show_phantom(view, batch)
+    manager.flush()
+    LAZY_PHANTOMS[view.buffer_id()] = _LazyPhantoms(rows)
 
 
 def _sublime_add_phantom(view, key, region, content, layout, on_navigate):
     """Pulled out to assist testing."""
-    view.add_phantom(
-        key, region,
-        content,
-        layout,
-        on_navigate
-    )
+    return view.add_phantom(key, region, content, layout, on_navigate)
+
+
+def _sublime_erase_phantom(view, phantom_id):
+    """Pulled out to assist testing."""
+    view.erase_phantom_by_id(phantom_id)
 
 
 def _sublime_add_regions(view, key, regions, scope, icon, flags):
@@ -495,7 +978,7 @@ def _sort_messages(window):
         window_info = WINDOW_MESSAGES[wid]
     except KeyError:
         return
-    batches_by_path = window_info['paths']
+    batches_by_path = window_info.paths
     items = []
     for path, batches in batches_by_path.items():
         for batch in batches:
@@ -506,7 +989,7 @@ def _sort_messages(window):
     for _, path, _, batch in items:
         batches = batches_by_path.setdefault(path, [])
         batches.append(batch)
-    window_info['paths'] = batches_by_path
+    window_info.set_paths(batches_by_path)
 
 
 def show_next_message(window, levels):
@@ -526,11 +1009,9 @@ def _show_message(window, current_idx, transient=False, force_open=False):
         window_info = WINDOW_MESSAGES[window.id()]
     except KeyError:
         return
-    if window_info['hidden']:
+    if window_info.hidden:
         redraw_all_open_views(window)
-    paths = window_info['paths']
-    path, batches = _ith_iter_item(paths.items(), current_idx[0])
-    batch = batches[current_idx[1]]
+    path, batch = window_info.navigation().entries[current_idx]
     msg = batch.first()
     _scroll_build_panel(window, msg)
     view = None
@@ -602,15 +1083,20 @@ def redraw_all_open_views(window):
         winfo = WINDOW_MESSAGES[window.id()]
     except KeyError:
         return
-    winfo['hidden'] = False
-    for path, batches in winfo['paths'].items():
+    winfo.hidden = False
+    lazy = util.get_setting('rust_phantom_lazy', False)
+    for path, batches in winfo.paths.items():
         views = util.open_views_for_file(window, path)
         if views:
+            if lazy:
+                update_lazy_phantoms(views[0], force=True)
             for batch in batches:
                 # Phantoms seem to be attached to the buffer.
-                _show_phantom(views[0], batch)
+                if not lazy:
+                    _show_phantom(views[0], batch)
                 for view in views:
                     _draw_region_highlights(view, batch)
+            get_phantom_manager(views[0]).flush()
 
 
 def show_messages_for_view(view):
@@ -619,12 +1105,17 @@ def show_messages_for_view(view):
         winfo = WINDOW_MESSAGES[view.window().id()]
     except KeyError:
         return
-    if winfo['hidden']:
+    if winfo.hidden:
         return
-    batches = winfo['paths'].get(view.file_name(), [])
+    batches = winfo.paths.get(view.file_name(), [])
+    lazy = util.get_setting('rust_phantom_lazy', False)
+    if lazy:
+        update_lazy_phantoms(view, force=True)
     for batch in batches:
-        _show_phantom(view, batch)
+        if not lazy:
+            _show_phantom(view, batch)
         _draw_region_highlights(view, batch)
+    get_phantom_manager(view).flush()
 
 
 def draw_regions_if_missing(view):
@@ -632,93 +1123,37 @@ def draw_regions_if_missing(view):
         winfo = WINDOW_MESSAGES[view.window().id()]
     except KeyError:
         return
-    if winfo['hidden']:
+    if winfo.hidden:
         return
-    batches = winfo['paths'].get(view.file_name(), [])
+    batches = winfo.paths.get(view.file_name(), [])
     msgs = itertools.chain.from_iterable(batches)
     if not any((view.get_regions(msg.region_key) for msg in msgs)):
         for batch in batches:
             _draw_region_highlights(view, batch)
 
 
-def _ith_iter_item(d, i):
-    return next(itertools.islice(d, i, None))
-
-
-def _advance_next_message(window, levels, wrap_around=False):
+def _advance_next_message(window, levels):
     """Update global batch_index to the next index."""
     try:
         win_info = WINDOW_MESSAGES[window.id()]
     except KeyError:
         return None
-    paths = win_info['paths']
-    path_idx, batch_idx = win_info['batch_index']
-    if path_idx == -1:
-        # First time.
-        path_idx = 0
-        batch_idx = 0
-    else:
-        batch_idx += 1
-
-    while path_idx < len(paths):
-        batches = _ith_iter_item(paths.values(), path_idx)
-        while batch_idx < len(batches):
-            batch = batches[batch_idx]
-            if not batch.hidden and _is_matching_level(levels, batch.first()):
-                current_idx = (path_idx, batch_idx)
-                win_info['batch_index'] = current_idx
-                return current_idx
-            batch_idx += 1
-        path_idx += 1
-        batch_idx = 0
-    if wrap_around:
-        # No matching entries, give up.
-        return None
-    else:
-        # Start over at the beginning of the list.
-        win_info['batch_index'] = (-1, -1)
-        return _advance_next_message(window, levels, wrap_around=True)
-
-
-def _last_index(paths):
-    path_idx = len(paths) - 1
-    msg_idx = len(_ith_iter_item(paths.values(), path_idx)) - 1
-    return (path_idx, msg_idx)
+    current_idx = win_info.navigation().next(levels, win_info.batch_index)
+    if current_idx is not None:
+        win_info.batch_index = current_idx
+    return current_idx
 
 
-def _advance_prev_message(window, levels, wrap_around=False):
+def _advance_prev_message(window, levels):
     """Update global batch_index to the previous index."""
     try:
         win_info = WINDOW_MESSAGES[window.id()]
     except KeyError:
         return None
-    paths = win_info['paths']
-    path_idx, batch_idx = win_info['batch_index']
-    if path_idx == -1:
-        # First time, start at the end.
-        path_idx, batch_idx = _last_index(paths)
-    else:
-        batch_idx -= 1
-
-    while path_idx >= 0:
-        batches = _ith_iter_item(paths.values(), path_idx)
-        while batch_idx >= 0:
-            batch = batches[batch_idx]
-            if not batch.hidden and _is_matching_level(levels, batch.first()):
-                current_idx = (path_idx, batch_idx)
-                win_info['batch_index'] = current_idx
-                return current_idx
-            batch_idx -= 1
-        path_idx -= 1
-        if path_idx >= 0:
-            batch_idx = len(_ith_iter_item(paths.values(), path_idx)) - 1
-    if wrap_around:
-        # No matching entries, give up.
-        return None
-    else:
-        # Start over at the end of the list.
-        win_info['batch_index'] = (-1, -1)
-        return _advance_prev_message(window, levels, wrap_around=True)
+    current_idx = win_info.navigation().prev(levels, win_info.batch_index)
+    if current_idx is not None:
+        win_info.batch_index = current_idx
+    return current_idx
 
 
 def _is_matching_level(levels, message):
@@ -753,24 +1188,23 @@ def list_messages(window):
         # XXX: Or dialog?
         window.show_quick_panel(["No messages available"], None)
         return
-    if win_info['hidden']:
+    if win_info.hidden:
         redraw_all_open_views(window)
     panel_items = []
     jump_to = []
-    for path_idx, (path, batches) in enumerate(win_info['paths'].items()):
-        for batch_idx, batch in enumerate(batches):
-            if not isinstance(batch, PrimaryBatch):
-                continue
-            message = batch.primary_message
-            jump_to.append((path_idx, batch_idx))
-            if message.span:
-                path_label = '%s:%s' % (
-                    _relative_path(window, path),
-                    message.span[0][0] + 1)
-            else:
-                path_label = _relative_path(window, path)
-            item = [message.text, path_label]
-            panel_items.append(item)
+    for pos, (path, batch) in enumerate(win_info.navigation().entries):
+        if not isinstance(batch, PrimaryBatch):
+            continue
+        message = batch.primary_message
+        jump_to.append(pos)
+        if message.span:
+            path_label = '%s:%s' % (
+                _relative_path(window, path),
+                message.span[0][0] + 1)
+        else:
+            path_label = _relative_path(window, path)
+        item = [message.text, path_label]
+        panel_items.append(item)
 
     def on_done(idx):
         _show_message(window, jump_to[idx], force_open=True)
@@ -787,13 +1221,22 @@ def message_counts(window):
         win_info = WINDOW_MESSAGES[window.id()]
     except KeyError:
         return result
-    for batches in win_info['paths'].values():
+    for batches in win_info.paths.values():
         for batch in batches:
             if isinstance(batch, PrimaryBatch):
                 result[batch.first().level] += 1
     return result
 
 
+def duplicate_counts(window):
+    """Returns a Counter of the duplicate messages that were skipped, see
+    `MessageStore.duplicates`."""
+    try:
+        return WINDOW_MESSAGES[window.id()].duplicates.copy()
+    except KeyError:
+        return collections.Counter()
+
+
 def add_rust_messages(window, base_path, info, target_path, msg_cb):
     """Add messages from Rust JSON to Sublime views.
 
@@ -820,21 +1263,23 @@ def add_rust_messages(window, base_path, info, target_path, msg_cb):
         primary_message)
     if not primary_message.path:
         return
-    if _is_duplicate_message(window, primary_message):
+    store = _get_store(window)
+    if primary_message.duplicate_children:
+        store.duplicates['children'] += primary_message.duplicate_children
+    if store.is_duplicate(primary_message):
+        store.duplicates['messages'] += 1
         return
     batches = _batch_and_cross_link(window, primary_message)
     _save_batches(window, batches, msg_cb)
 
 
-def _is_duplicate_message(window, primary_message):
-    batches = WINDOW_MESSAGES.get(window.id(), {})\
-                             .get('paths', {})\
-                             .get(primary_message.path, [])
-    for batch in batches:
-        if isinstance(batch, PrimaryBatch):
-            if batch.primary_message.is_similar(primary_message):
-                return True
-    return False
+def _get_store(window):
+    """Returns the `MessageStore` of the window, creating it if needed."""
+    try:
+        return WINDOW_MESSAGES[window.id()]
+    except KeyError:
+        store = WINDOW_MESSAGES[window.id()] = MessageStore()
+        return store
 
 
 def _is_external(window, path):
@@ -959,12 +1404,9 @@ def _collect_rust_messages(window, base_path, info, target_path,
                 msg_cb(child)
             return
         child.span = make_span_region(span)
-        if any(map(lambda m: m.is_similar(child), message.children)):
-            # Duplicate message, skip.  This happens with some of the
-            # macro help messages.
-            return
-        child.parent = message
-        message.children.append(child)
+        # Duplicate messages are skipped.  This happens with some of the
+        # macro help messages.
+        message.add_child(child)
 
     if len(info['spans']) == 0:
         if parent_info:
@@ -1175,32 +1617,23 @@ def _save_batches(window, batches, msg_cb):
 
     - Saves batches to WINDOW_MESSAGES global.
     - Updates the region_key for each message.
-    - Displays phantoms if a view is already open.
+    - Displays phantoms if a view is already open.  They are displayed
+      together after a short delay, or by `messages_finished`.
     - Calls `msg_cb` for each individual message.
     """
-    wid = window.id()
-    try:
-        path_to_batches = WINDOW_MESSAGES[wid]['paths']
-    except KeyError:
-        path_to_batches = collections.OrderedDict()
-        WINDOW_MESSAGES[wid] = {
-            'paths': path_to_batches,
-            'batch_index': (-1, -1),
-            'hidden': False,
-        }
+    store = _get_store(window)
+    _schedule_flush_phantoms()
 
     for batch in batches:
-        path_batches = path_to_batches.setdefault(batch.path(), [])
-        # Flatten to a list of messages so each message gets a unique ID.
-        num = len(list(itertools.chain.from_iterable(path_batches)))
-        path_batches.append(batch)
-        for i, msg in enumerate(batch):
-            msg.region_key = 'rust-%i' % (num + i,)
-        if not WINDOW_MESSAGES[wid]['hidden']:
+        store.add_batch(batch)
+        if not store.hidden:
             views = util.open_views_for_file(window, batch.path())
             if views:
                 # Phantoms seem to be attached to the buffer.
-                _show_phantom(views[0], batch)
+                if util.get_setting('rust_phantom_lazy', False):
+                    _show_phantom_lazy(views[0], batch)
+                else:
+                    _show_phantom(views[0], batch)
                 for view in views:
                     _draw_region_highlights(view, batch)
             if msg_cb:
@@ -0,0 +1,186 @@
+"""Cache of `cargo metadata` output.
+
+Metadata is needed for every on-save check and for target detection, and
+running Cargo each time is slow.  The output is cached per workspace root and
+toolchain.  An entry is considered stale when any member `Cargo.toml`, the
+`Cargo.lock` file, or a `.cargo/config` file changes.  A stale entry is
+still returned while a background thread runs Cargo to refresh it, so only
+the very first request for a workspace waits on Cargo.
+
+Callers get their own copy of the metadata, so they are free to modify it.
+"""
+
+import copy
+import os
+import threading
+
+from . import util, log
+
+# Config files Cargo reads from the workspace and all of its parents.
+CONFIG_NAMES = ('config', 'config.toml')
+
+
+class CacheEntry(object):
+
+    """Cached metadata for a workspace."""
+
+    def __init__(self, metadata, stamp):
+        # Dictionary from Cargo.
+        self.metadata = metadata
+        # Dictionary of {path: mtime} of files that affect the metadata.
+        self.stamp = stamp
+        # True while a background refresh is running.
+        self.refreshing = False
+
+
+# Map (workspace_root, toolchain) to a `CacheEntry`.
+_entries = {}
+# Map (manifest_dir, toolchain) to workspace_root for every package that has
+# been loaded.
+_roots = {}
+# Map (manifest_dir, toolchain) to a `threading.Event` that is set when a
+# load that is in progress finishes.
+_loading = {}
+_lock = threading.Lock()
+
+
+class _RefreshOwner(object):
+
+    """Owner of the processes run by background refreshes.
+
+    Without this, the process would belong to whatever `RustThread` happens
+    to be running in the window, and be killed or counted along with it.
+    """
+
+    should_exit = False
+
+    def __init__(self):
+        from . import rust_thread
+        self.priority = rust_thread.PRIORITY_BACKGROUND
+
+
+def get_cargo_metadata(window, cwd, toolchain=None):
+    """Load Cargo metadata, using the cache if possible.
+
+    See `util.get_cargo_metadata` for a description of the return value.
+
+    :raises ProcessTermiantedError: Process was terminated by another thread.
+    """
+    manifest_dir = util.find_cargo_manifest(cwd)
+    if manifest_dir is None:
+        # Let Cargo report the error.
+        return _run_metadata(window, cwd, toolchain)
+    key = (manifest_dir, toolchain)
+    while True:
+        with _lock:
+            root = _roots.get(key)
+            entry = _entries.get((root, toolchain))
+            if entry is not None:
+                if (not entry.refreshing and
+                        _stamp(entry.metadata) != entry.stamp):
+                    entry.refreshing = True
+                    t = threading.Thread(target=_refresh,
+                                         args=(window, manifest_dir,
+                                               toolchain, entry),
+                                         name='Rust Metadata Refresh')
+                    t.start()
+                return copy.deepcopy(entry.metadata)
+            loading = _loading.get(key)
+            if loading is None:
+                loading = _loading[key] = threading.Event()
+                break
+        # Another thread is already running Cargo for this package.  Use its
+        # result, or try again if it failed.
+        loading.wait()
+    try:
+        return copy.deepcopy(_load(window, manifest_dir, toolchain))
+    finally:
+        with _lock:
+            del _loading[key]
+        loading.set()
+
+
+def clear():
+    """Discard all cached metadata."""
+    with _lock:
+        _entries.clear()
+        _roots.clear()
+
+
+def _load(window, cwd, toolchain):
+    metadata = _run_metadata(window, cwd, toolchain)
+    if metadata:
+        _store(metadata, _stamp(metadata), toolchain)
+    return metadata
+
+
+def _refresh(window, cwd, toolchain, entry):
+    try:
+        # The stamp is computed before running Cargo so that changes made
+        # while it is running are picked up next time.
+        stamp = _stamp(entry.metadata)
+        metadata = _run_metadata(window, cwd, toolchain, owner=_RefreshOwner())
+    except Exception as e:
+        log.log(window, 'Failed to refresh Cargo metadata: %s', e)
+        metadata = None
+    if metadata:
+        # The member list may have changed, so the stamp is recomputed.
+        if set(_manifest_paths(metadata)) != set(_manifest_paths(entry.metadata)):
+            stamp = _stamp(metadata)
+        _store(metadata, stamp, toolchain)
+    else:
+        # Keep the old value, and try again on the next request.
+        entry.refreshing = False
+
+
+def _store(metadata, stamp, toolchain):
+    root = _workspace_root(metadata)
+    with _lock:
+        _entries[(root, toolchain)] = CacheEntry(metadata, stamp)
+        for path in _manifest_paths(metadata):
+            _roots[(os.path.dirname(path), toolchain)] = root
+        _roots[(root, toolchain)] = root
+
+
+def _run_metadata(window, cwd, toolchain, owner=None):
+    from . import rust_proc
+    cmd = ['cargo']
+    if toolchain:
+        cmd.append('+' + toolchain)
+    cmd.extend(['metadata', '--no-deps'])
+    output = rust_proc.slurp_json(window,
+                                  cmd,
+                                  cwd=cwd,
+                                  owner=owner)
+    if output:
+        return output[0]
+    else:
+        return None
+
+
+def _workspace_root(metadata):
+    # 'workspace_root' key added in 1.24.
+    root = metadata.get('workspace_root')
+    if root:
+        return os.path.normpath(root)
+    paths = _manifest_paths(metadata)
+    return os.path.dirname(paths[0]) if paths else None
+
+
+def _manifest_paths(metadata):
+    return [os.path.normpath(package['manifest_path'])
+            for package in metadata['packages']]
+
+
+def _stamp(metadata):
+    """Returns a dictionary of {path: mtime} for all files that affect the
+    metadata of a workspace."""
+    root = _workspace_root(metadata)
+    paths = _manifest_paths(metadata)
+    if root:
+        paths.append(os.path.join(root, 'Cargo.toml'))
+        paths.append(os.path.join(root, 'Cargo.lock'))
+        for path in util.parent_dirs(root):
+            for name in CONFIG_NAMES:
+                paths.append(os.path.join(path, '.cargo', name))
+    return {path: util.file_mtime(path) for path in paths}
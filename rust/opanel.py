@@ -2,9 +2,13 @@
 
 import sublime
 
+import collections
 import os
 import re
-from . import rust_proc, messages, util, semver, levels, log
+import tempfile
+import threading
+import time
+from . import rust_proc, messages, util, versions, levels, log
 
 # Use the same panel name that Sublime's build system uses so that "Show Build
 # Results" will open the same panel.  I don't see any particular reason why
@@ -51,12 +55,240 @@ def _append(view, text):
                                 'scroll_to_end': True})
 
 
+class OutputQueue(object):
+
+    """Bounded queue of output waiting to be displayed in the output panel.
+
+    The reader thread puts text in the queue, and the UI thread periodically
+    drains it, appending all of the accumulated text at once.  Items may also
+    be callables, which are run on the UI thread in order with the text.
+
+    The `rust_output_overflow` setting determines what happens when the
+    queue is full:
+
+    - "block": The reader waits until there is room (which eventually makes
+      the process wait on the pipe).
+    - "drop_oldest": The oldest text in the queue is discarded.
+    - "spill": New text is written to a temporary file instead, and is
+      displayed from there once the UI thread catches up.  Callables that
+      arrive while spilling wait for the spilled text so that the order is
+      kept.
+    """
+
+    # Path of the file where text is spilled, or None.  The file is removed
+    # once everything in it has been displayed.
+    spill_path = None
+    # Seconds `close` waits for the UI thread.
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, window, on_text):
+        """
+        :param window: Sublime window.
+        :param on_text: Function called on the UI thread with a string of
+            coalesced text.
+        """
+        self.window = window
+        self.on_text = on_text
+        self.interval = util.get_setting('rust_output_flush_interval', 50)
+        self.limit = util.get_setting('rust_output_buffer_size', 1048576)
+        self.policy = util.get_setting('rust_output_overflow', 'block')
+        self.items = collections.deque()
+        # Number of characters of text in `items`.
+        self.size = 0
+        self.cond = threading.Condition()
+        self.flush_scheduled = False
+        # True while the spill file has text that has not been displayed.
+        self.spilling = False
+        self._spill_file = None
+        self._spill_reader = None
+        # Characters written to and read from the spill file.
+        self._spill_written = 0
+        self._spill_read = 0
+        # `(position, callable)` for callables that arrived while spilling,
+        # where position is the amount of spilled text that comes before it.
+        self._after_spill = collections.deque()
+        # Lines dropped since the last flush.
+        self._dropped_pending = 0
+        # Statistics.
+        self.start_time = time.time()
+        self.lines = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked_time = 0.0
+
+    def put_text(self, text):
+        """Add text to the queue.  May block depending on the overflow
+        policy."""
+        num_lines = text.count('\n')
+        with self.cond:
+            self.lines += num_lines
+            if self.spilling:
+                # Keep the order with the text already spilled.
+                self._spill(text, num_lines)
+                return
+            if self._is_full(text):
+                if self.policy == 'drop_oldest':
+                    self._drop_oldest(len(text))
+                elif self.policy == 'spill':
+                    self._spill(text, num_lines)
+                    return
+                else:
+                    start = time.time()
+                    while self._is_full(text):
+                        self._schedule()
+                        self.cond.wait(0.1)
+                    self.blocked_time += time.time() - start
+            self.items.append(text)
+            self.size += len(text)
+            self._schedule()
+
+    def put_call(self, f):
+        """Add a callable to run on the UI thread.  Never blocks."""
+        with self.cond:
+            if self.spilling:
+                self._after_spill.append((self._spill_written, f))
+            else:
+                self.items.append(f)
+            self._schedule()
+
+    def close(self, f):
+        """Run `f` on the UI thread after everything in the queue, and wait
+        a limited time for it to finish.
+
+        The wait is bounded so that the reader thread cannot deadlock with a
+        UI thread that is itself waiting on the reader.
+        """
+        done = threading.Event()
+
+        def finish():
+            try:
+                f()
+            finally:
+                done.set()
+
+        self.put_call(finish)
+        if not done.wait(self.CLOSE_TIMEOUT):
+            log.log(self.window, 'Output panel: UI thread busy, not waiting '
+                    'for the output to finish.')
+        log.log(self.window, 'Output panel: %i lines (%.0f lines/s), '
+                '%i flushes, %i lines dropped, %i lines spilled, '
+                'blocked %.1fs',
+                self.lines, self.lines / max(time.time() - self.start_time, 0.001),
+                self.flushes, self.dropped, self.spilled, self.blocked_time)
+
+    def flush(self):
+        """Append everything in the queue.  Must be called on the UI
+        thread."""
+        with self.cond:
+            items = list(self.items)
+            self.items.clear()
+            self.size = 0
+            dropped = self._dropped_pending
+            self._dropped_pending = 0
+            self.flush_scheduled = False
+            self.flushes += 1
+            if self.spilling:
+                items.extend(self._replay_spill())
+            self.cond.notify_all()
+        if dropped:
+            self.on_text('[%i lines of output dropped]\n' % (dropped,))
+        text = []
+        for item in items:
+            if isinstance(item, str):
+                text.append(item)
+            else:
+                if text:
+                    self.on_text(''.join(text))
+                    text = []
+                item()
+        if text:
+            self.on_text(''.join(text))
+
+    def _is_full(self, text):
+        return self.limit and self.size and \
+            self.size + len(text) > self.limit
+
+    def _schedule(self):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            sublime.set_timeout(self.flush, self.interval)
+
+    def _drop_oldest(self, needed):
+        while self.size and self.size + needed > self.limit:
+            for i, item in enumerate(self.items):
+                if isinstance(item, str):
+                    break
+            else:
+                return
+            del self.items[i]
+            self.size -= len(item)
+            num_lines = item.count('\n')
+            self.dropped += num_lines
+            self._dropped_pending += num_lines
+
+    def _spill(self, text, num_lines):
+        if self._spill_file is None:
+            fd, self.spill_path = tempfile.mkstemp(prefix='rust-output-',
+                                                   suffix='.txt')
+            self._spill_file = open(fd, 'w', encoding='utf-8', newline='')
+            self._spill_reader = open(self.spill_path, encoding='utf-8',
+                                      newline='')
+        self.spilling = True
+        self._spill_file.write(text)
+        self._spill_file.flush()
+        self._spill_written += len(text)
+        self.spilled += num_lines
+        self._schedule()
+
+    def _replay_spill(self):
+        """Read up to `limit` characters of spilled text, along with the
+        callables that were queued in between.  Once everything has been
+        read, the file is removed.  Called with `cond` held."""
+        result = []
+        budget = self.limit
+        while True:
+            if self._after_spill:
+                pos = self._after_spill[0][0]
+            else:
+                pos = self._spill_written
+            n = min(pos - self._spill_read, budget)
+            if n:
+                text = self._spill_reader.read(n)
+                result.append(text)
+                self._spill_read += len(text)
+                budget -= len(text)
+            if self._spill_read < pos:
+                # Out of budget, continue with the next flush.
+                self._schedule()
+                return result
+            if not self._after_spill:
+                break
+            result.append(self._after_spill.popleft()[1])
+        self._spill_file.close()
+        self._spill_reader.close()
+        try:
+            os.unlink(self.spill_path)
+        except OSError:
+            pass
+        self._spill_file = self._spill_reader = self.spill_path = None
+        self._spill_written = self._spill_read = 0
+        self.spilling = False
+        return result
+
+
 class OutputListener(rust_proc.ProcListener):
 
-    """Listener used for displaying results to a Sublime output panel."""
+    """Listener used for displaying results to a Sublime output panel.
+
+    Output is sent through an `OutputQueue` so that a process that prints a
+    lot does not flood the UI thread.
+    """
 
     # Sublime view used for output.
     output_view = None
+    # `OutputQueue` of text waiting to be displayed.
+    queue = None
 
     def __init__(self, window, base_path, command_name, rustc_version):
         self.window = window
@@ -66,40 +298,56 @@ class OutputListener(rust_proc.ProcListener):
 
     def on_begin(self, proc):
         self.output_view = create_output_panel(self.window, self.base_path)
+        self.queue = OutputQueue(self.window, self._on_text)
         self._append('[Running: %s]' % (' '.join(proc.cmd),))
 
     def on_data(self, proc, data):
+        self.on_data_batch(proc, [data])
+
+    def on_data_batch(self, proc, lines):
+        self.queue.put_text(''.join(lines))
+
+    def _on_text(self, text):
         region_start = self.output_view.size()
-        self._append(data, nl=False)
+        _append(self.output_view, text)
         # Check for test errors.
         if self.command_name == 'test':
-            # Re-fetch the data to handle things like \t expansion.
-            appended = self.output_view.substr(
-                sublime.Region(region_start, self.output_view.size()))
-            m = re.search(r', ([^,<\n]*\.[A-z]{2}):([0-9]+):([0-9]+)',
-                appended)
-            if m:
-                path = os.path.join(self.base_path, m.group(1))
-                if not os.path.exists(path):
-                    # Panics outside of the crate display a path to that
-                    # crate's source file (such as libcore), which is probably
-                    # not available.
-                    return
-                message = messages.Message()
-                lineno = int(m.group(2)) - 1
-                # Region columns appear to the left, so this is +1.
-                col = int(m.group(3))
-                # Rust 1.24 changed column numbering to be 1-based.
-                if semver.match(self.rustc_version, '>=1.24.0-beta'):
-                    col -= 1
-                message.span = ((lineno, col), (lineno, col))
-                # +2 to skip ", "
-                build_region = sublime.Region(region_start + m.start() + 2,
-                                              region_start + m.end())
-                message.output_panel_region = build_region
-                message.path = path
-                message.level = levels.level_from_str('error')
-                messages.add_message(self.window, message)
+            self._check_test_errors(region_start)
+
+    def _check_test_errors(self, region_start):
+        # Re-fetch the data to handle things like \t expansion.
+        appended = self.output_view.substr(
+            sublime.Region(region_start, self.output_view.size()))
+        line_start = region_start
+        for line in appended.split('\n'):
+            self._check_test_error(line, line_start)
+            line_start += len(line) + 1
+
+    def _check_test_error(self, line, region_start):
+        m = re.search(r', ([^,<\n]*\.[A-z]{2}):([0-9]+):([0-9]+)', line)
+        if m:
+            path = os.path.join(self.base_path, m.group(1))
+            if not os.path.exists(path):
+                # Panics outside of the crate display a path to that
+                # crate's source file (such as libcore), which is probably
+                # not available.
+                return
+            message = messages.Message()
+            lineno = int(m.group(2)) - 1
+            # Region columns appear to the left, so this is +1.
+            col = int(m.group(3))
+            # Rust 1.24 changed column numbering to be 1-based.
+            if versions.has_capability(self.rustc_version,
+                                       'one_based_columns'):
+                col -= 1
+            message.span = ((lineno, col), (lineno, col))
+            # +2 to skip ", "
+            build_region = sublime.Region(region_start + m.start() + 2,
+                                          region_start + m.end())
+            message.output_panel_region = build_region
+            message.path = path
+            message.level = levels.level_from_str('error')
+            messages.add_message(self.window, message)
 
     def on_error(self, proc, message):
         self._append(message)
@@ -118,6 +366,10 @@ class OutputListener(rust_proc.ProcListener):
         if not message.text:
             # Region-only messages can be ignored.
             return
+        # The region is determined once the text is actually appended.
+        self.queue.put_call(lambda: self._append_message(message))
+
+    def _append_message(self, message):
         region_start = self.output_view.size() + len(message.level.name) + 2
         path = message.path
         if path:
@@ -127,21 +379,24 @@ class OutputListener(rust_proc.ProcListener):
                 highlight_text = '%s:%d' % (path, message.span[0][0] + 1)
             else:
                 highlight_text = path
-            self._append('%s: %s: %s' % (message.level, highlight_text, message.text))
+            self._append_now('%s: %s: %s' % (message.level, highlight_text, message.text))
             region = sublime.Region(region_start,
                                     region_start + len(highlight_text))
         else:
-            self._append('%s: %s' % (message.level, message.text))
+            self._append_now('%s: %s' % (message.level, message.text))
             region = sublime.Region(region_start)
         message.output_panel_region = region
 
-    def on_finished(self, proc, rc):
+    def on_finished(self, proc, rc, usage):
         if rc:
-            self._append('[Finished in %.1fs with exit code %d]' % (
-                proc.elapsed, rc))
+            self._append('[Finished in %s with exit code %d]' % (
+                usage.summary(), rc))
             self._display_debug(proc)
         else:
-            self._append('[Finished in %.1fs]' % proc.elapsed)
+            self._append('[Finished in %s]' % (usage.summary(),))
+        self.queue.close(self._finish)
+
+    def _finish(self):
         messages.messages_finished(self.window)
         # Tell Sublime to find all of the lines with pattern from
         # result_file_regex.
@@ -151,6 +406,12 @@ class OutputListener(rust_proc.ProcListener):
         self._append('[Build interrupted]')
 
     def _append(self, message, nl=True):
+        """Queue text to be added to the output panel."""
+        if nl:
+            message += '\n'
+        self.queue.put_call(lambda: self._append_now(message, nl=False))
+
+    def _append_now(self, message, nl=True):
         if nl:
             message += '\n'
         _append(self.output_view, message)
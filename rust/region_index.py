@@ -0,0 +1,178 @@
+"""Interval index of the message regions in a file.
+
+The regions are kept sorted by their start point in a segment tree.  Each
+node holds the largest start and end point of its range, plus a pending
+offset for its children.  This supports:
+
+- Finding all regions that overlap a range of points in O(log n + k log n),
+  which is used for hover and status bar lookups.
+- Shifting every region after an edit in O(log n), so the index follows the
+  text as it is modified without asking Sublime for the regions again.
+
+Only regions that touch an edited range need to be read back from Sublime.
+"""
+
+_NEG_INF = float('-inf')
+_POS_INF = float('inf')
+
+
+class RegionIndex(object):
+
+    """An interval index over a fixed list of regions.
+
+    :param entries: List of `(begin, end, payload)` tuples.  `payload` is
+        returned from queries.
+    """
+
+    def __init__(self, entries):
+        entries = sorted(entries, key=lambda e: (e[0], e[1]))
+        self.payloads = [e[2] for e in entries]
+        self.n = n = len(entries)
+        size = 1
+        while size < max(n, 1):
+            size *= 2
+        self.size = size
+        # Padding leaves have an infinite start so that searches for a start
+        # point stop before them, and no end so they never match.
+        self._begin = [_POS_INF] * (2 * size)
+        self._end = [_NEG_INF] * (2 * size)
+        self._lazy = [0] * (2 * size)
+        for i, (begin, end, _) in enumerate(entries):
+            self._begin[size + i] = begin
+            self._end[size + i] = end
+        for node in range(size - 1, 0, -1):
+            self._pull(node)
+
+    def __len__(self):
+        return self.n
+
+    def _pull(self, node):
+        left = 2 * node
+        right = left + 1
+        lazy = self._lazy[node]
+        self._begin[node] = max(self._begin[left], self._begin[right]) + lazy
+        self._end[node] = max(self._end[left], self._end[right]) + lazy
+
+    def _first_after(self, point):
+        """Returns the index of the first region that starts after point."""
+        if self._begin[1] <= point:
+            return self.n
+        node = 1
+        acc = 0
+        while node < self.size:
+            acc += self._lazy[node]
+            left = 2 * node
+            if self._begin[left] + acc > point:
+                node = left
+            else:
+                node = left + 1
+        return min(node - self.size, self.n)
+
+    def _overlapping(self, lo, hi):
+        """Returns a list of indexes of regions with begin <= hi and
+        end >= lo."""
+        stop = self._first_after(hi)
+        result = []
+        if stop == 0:
+            return result
+        # (node, node_lo, node_hi, offset from ancestors)
+        stack = [(1, 0, self.size, 0)]
+        while stack:
+            node, node_lo, node_hi, acc = stack.pop()
+            if node_lo >= stop or self._end[node] + acc < lo:
+                continue
+            if node >= self.size:
+                result.append(node - self.size)
+                continue
+            acc += self._lazy[node]
+            mid = (node_lo + node_hi) // 2
+            stack.append((2 * node + 1, mid, node_hi, acc))
+            stack.append((2 * node, node_lo, mid, acc))
+        return result
+
+    def overlapping(self, lo, hi=None):
+        """Returns the payloads of all regions that overlap the range of
+        points `lo` to `hi` (inclusive), in order of their start point."""
+        if hi is None:
+            hi = lo
+        return [self.payloads[i] for i in self._overlapping(lo, hi)]
+
+    def region(self, i):
+        """Returns the current `(begin, end)` of the region at index i."""
+        node = self.size + i
+        begin = self._begin[node]
+        end = self._end[node]
+        node //= 2
+        while node:
+            begin += self._lazy[node]
+            end += self._lazy[node]
+            node //= 2
+        return begin, end
+
+    def _add(self, start, delta, node=1, node_lo=0, node_hi=None):
+        """Add delta to all regions from index start to the end."""
+        if node_hi is None:
+            node_hi = self.size
+        if node_hi <= start:
+            return
+        if node_lo >= start:
+            self._begin[node] += delta
+            self._end[node] += delta
+            if node < self.size:
+                self._lazy[node] += delta
+            return
+        mid = (node_lo + node_hi) // 2
+        self._add(start, delta, 2 * node, node_lo, mid)
+        self._add(start, delta, 2 * node + 1, mid, node_hi)
+        self._pull(node)
+
+    def set_region(self, i, begin, end):
+        """Set the region at index i.
+
+        :returns: False if this would break the ordering of the index, in
+            which case nothing is changed and the index should be rebuilt.
+        """
+        if i > 0 and self.region(i - 1)[0] > begin:
+            return False
+        if i + 1 < self.n and self.region(i + 1)[0] < begin:
+            return False
+        # Remove the ancestor offsets from the stored value.
+        acc = 0
+        node = (self.size + i) // 2
+        while node:
+            acc += self._lazy[node]
+            node //= 2
+        node = self.size + i
+        self._begin[node] = begin - acc
+        self._end[node] = end - acc
+        node //= 2
+        while node:
+            self._pull(node)
+            node //= 2
+        return True
+
+    def apply_change(self, a, b, length):
+        """Update the index for text between points a and b being replaced
+        with text of the given length.
+
+        Regions after the change are shifted.  Regions touching the change
+        get an approximate position.
+
+        :returns: List of indexes of the regions touching the change.  Their
+            actual positions should be read back with `set_region`.
+        """
+        delta = length - (b - a)
+        touched = self._overlapping(a, b)
+        if delta:
+            self._add(self._first_after(b), delta)
+        for i in touched:
+            begin, end = self.region(i)
+            if begin >= a:
+                begin = a
+            if end > b:
+                end += delta
+            elif end >= a:
+                end = a + length
+            self.set_region(i, begin, end)
+        return touched
+
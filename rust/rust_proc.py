@@ -1,8 +1,19 @@
 """Module for running cargo or rustc and parsing the output.
 
-It is assumed a thread only ever has one process running at a time.
+A window may have several processes running at the same time (limited by the
+`rust_max_concurrent_processes` setting).  Each process has an owner
+(typically the `RustThread` that started it) and an optional tag, which can be
+used to find or terminate specific processes.
+
+The number of check and background processes across all windows can also be
+limited (by the `rust_max_global_processes` setting).  Interactive commands
+(which may run for a long time, such as `cargo run`) and short queries (such
+as `cargo metadata`) do not count against this limit.  When a slot frees up,
+the window with focus goes first, then the window that least recently started
+a process.
 """
 
+import itertools
 import json
 import os
 import re
@@ -11,18 +22,46 @@ import subprocess
 import sys
 import threading
 import time
-import shellenv
 import sublime
 import traceback
 
-from . import util, log
+from . import util, log, shell_env
 
-# Map Sublime window ID to RustProc.
+# Map Sublime window ID to a list of running RustProc objects.
 PROCS = {}
-PROCS_LOCK = threading.Lock()
-
-# Environment (as s dict) from the user's login shell.
-USER_SHELL_ENV = None
+# Guards PROCS, and is notified whenever a process finishes.
+PROCS_LOCK = threading.Condition()
+# List of RustProc objects waiting for a slot, in arrival order.
+WAITING = []
+# Map Sublime window ID to when a process in that window was last started
+# (as a value from `_GRANT_COUNTER`).
+_LAST_GRANT = {}
+_GRANT_COUNTER = itertools.count(1)
+
+# Cargo JSON messages that contain compiler diagnostics.  Use with the
+# `json_reasons` parameter of `RustProc.run`.
+DIAGNOSTIC_REASONS = ('compiler-message',)
+
+# Cargo always emits the "reason" key first, which allows the reason to be
+# determined without decoding the entire line.
+REASON_PREFIX = '{"reason":"'
+
+# How the child is placed in its own process group on POSIX, so that
+# `terminate` can kill the whole group:
+#
+# - 'process_group': `Popen(process_group=0)` (Python 3.11+).
+# - 'session': `Popen(start_new_session=True)`.
+# - 'preexec': `Popen(preexec_fn=os.setpgrp)`.
+#
+# The first two are done by CPython's C code between fork and exec, so no
+# Python code runs in the child and it is safe to start a process while
+# other threads are running.  A `preexec_fn` runs Python code in the child,
+# which can deadlock on a lock that another thread held at the time of the
+# fork.
+if sys.version_info >= (3, 11):
+    SPAWN_METHOD = 'process_group'
+else:
+    SPAWN_METHOD = 'session'
 
 
 class ProcessTerminatedError(Exception):
@@ -42,6 +81,15 @@ class ProcListener(object):
         """A line of text output by the process."""
         pass
 
+    def on_data_batch(self, proc, lines):
+        """A list of lines of text output by the process.
+
+        The default implementation calls `on_data` for each line.  Override
+        this to handle a large amount of output more efficiently.
+        """
+        for line in lines:
+            self.on_data(proc, line)
+
     def on_error(self, proc, message):
         """Called when there is an error, such as failure to decode utf-8."""
         log.critical(sublime.active_window(), 'Rust Error: %s', message)
@@ -50,8 +98,24 @@ class ProcListener(object):
         """Parsed JSON output from the command."""
         pass
 
-    def on_finished(self, proc, rc):
-        """Called after all output has been processed."""
+    def on_json_batch(self, proc, objs):
+        """A list of parsed JSON objects output by the command.
+
+        The default implementation calls `on_json` for each object.
+        """
+        for obj in objs:
+            try:
+                self.on_json(proc, obj)
+            except:
+                self.on_error(proc, 'Rust Enhanced Internal Error: %s' % (
+                    traceback.format_exc(),))
+
+    def on_finished(self, proc, rc, usage):
+        """Called after all output has been processed.
+
+        :param rc: The return code of the process.
+        :param usage: `ResourceUsage` of the process.
+        """
         pass
 
     def on_terminated(self, proc):
@@ -69,24 +133,33 @@ class SlurpListener(ProcListener):
     def on_json(self, proc, obj):
         self.json.append(obj)
 
+    def on_json_batch(self, proc, objs):
+        self.json.extend(objs)
+
     def on_data(self, proc, data):
         self.data.append(data)
 
+    def on_data_batch(self, proc, lines):
+        self.data.extend(lines)
+
 
-def _slurp(window, cmd, cwd):
+def _slurp(window, cmd, cwd, owner=None):
     p = RustProc()
+    # Queries are short, and are often needed before a check can start.
+    p.global_limit_exempt = True
     listener = SlurpListener()
-    p.run(window, cmd, cwd, listener)
+    p.run(window, cmd, cwd, listener, owner=owner)
     rc = p.wait()
     return (rc, listener)
 
 
-def slurp_json(window, cmd, cwd):
+def slurp_json(window, cmd, cwd, owner=None):
     """Run a command and return the JSON output from it.
 
     :param window: Sublime window.
     :param cmd: The command to run (list of strings).
     :param cwd: The directory where to run the command.
+    :param owner: The owner of the process (see `RustProc.run`).
 
     :returns: List of parsed JSON objects.
 
@@ -94,7 +167,7 @@ def slurp_json(window, cmd, cwd):
     :raises OSError: Failed to launch the child process. `FileNotFoundError`
         is a typical example if the executable is not found.
     """
-    rc, listener = _slurp(window, cmd, cwd)
+    rc, listener = _slurp(window, cmd, cwd, owner=owner)
     if not listener.json and rc:
         log.critical(window, 'Failed to run: %s', cmd)
         log.critical(window, ''.join(listener.data))
@@ -123,6 +196,238 @@ def check_output(window, cmd, cwd):
     return output
 
 
+# Map Sublime window ID to (key, environment dictionary) for the base
+# environment of child processes.  See `make_env`.
+_ENV_CACHE = {}
+# Incremented whenever a setting that affects the environment changes.
+_ENV_GENERATION = 0
+_ENV_LOCK = threading.Lock()
+
+
+def make_env(window, env=None):
+    """Returns the environment dictionary for running a child process.
+
+    The base environment (os.environ, the login shell environment, and the
+    `rust_env` setting) is cached per window, and rebuilt after settings
+    change or the shell environment is cleared.  The result may be shared,
+    and must not be modified.
+
+    :param window: Sublime window.
+    :param env: Dictionary of environment variables to add (or None).
+    """
+    key = (_ENV_GENERATION, shell_env.generation,
+           _project_env_settings(window))
+    with _ENV_LOCK:
+        cached = _ENV_CACHE.get(window.id())
+    if cached is not None and cached[0] == key:
+        base = cached[1]
+    else:
+        base = _build_env(window)
+        with _ENV_LOCK:
+            _ENV_CACHE[window.id()] = (key, base)
+    if env:
+        result = base.copy()
+        result.update(env)
+        return result
+    return base
+
+
+def invalidate_env():
+    """Discard the cached environments.  Called when settings change."""
+    global _ENV_GENERATION
+    with _ENV_LOCK:
+        _ENV_GENERATION += 1
+        _ENV_CACHE.clear()
+
+
+def _project_env_settings(window):
+    # Project settings do not have change notifications, so the relevant
+    # values are part of the cache key.
+    pdata = window.project_data()
+    if not pdata:
+        return None
+    settings = pdata.get('settings', {})
+    return (settings.get('rust_include_shell_env'), settings.get('rust_env'))
+
+
+def _build_env(window):
+    # Settings come from the given window, which may not be the active one.
+    result = os.environ.copy()
+    if util.get_setting('rust_include_shell_env', True, window=window):
+        result.update(shell_env.get_env())
+
+    rust_env = util.get_setting('rust_env', window=window)
+    if rust_env:
+        for k, v in rust_env.items():
+            result[k] = os.path.expandvars(v)
+    return result
+
+
+# ioprio_set syscall numbers, keyed by `platform.machine()`.
+IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'aarch64': 30,
+    'i386': 289,
+    'i686': 289,
+    'armv7l': 314,
+}
+IOPRIO_CLASSES = {
+    'best-effort': 2,
+    'idle': 3,
+}
+
+
+def _set_io_priority(pgid, io_class):
+    """Set the I/O scheduling class of a process group (Linux only).
+
+    :param io_class: 'best-effort' (at the lowest level) or 'idle'.
+    :raises OSError: Failed to set the priority.
+    """
+    import ctypes
+    import ctypes.util
+    import platform
+    if not sys.platform.startswith('linux'):
+        return
+    nr = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if nr is None or io_class not in IOPRIO_CLASSES:
+        raise OSError('I/O class %r not supported on %s' % (
+            io_class, platform.machine()))
+    # Priority is the class in the top 3 bits and the level (0-7, 7 is the
+    # lowest) in the rest.
+    level = 7 if io_class == 'best-effort' else 0
+    ioprio = IOPRIO_CLASSES[io_class] << 13 | level
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    IOPRIO_WHO_PGRP = 2
+    if libc.syscall(nr, IOPRIO_WHO_PGRP, pgid, ioprio) < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def global_process_limit():
+    """Returns the maximum number of check and background processes that may
+    run at the same time across all windows, or 0 for no limit."""
+    limit = util.get_setting('rust_max_global_processes')
+    if limit is None:
+        # Cargo already uses every CPU, so only a few checks are worth
+        # running at the same time.
+        limit = max(2, (_cpu_count() or 4) // 4)
+    return limit
+
+
+def _cpu_count():
+    # os.cpu_count is not available on Python 3.3.
+    try:
+        return os.cpu_count()
+    except AttributeError:
+        import multiprocessing
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return None
+
+
+def _global_count():
+    """Returns the number of running processes that count against the global
+    limit.  Must be called with PROCS_LOCK held."""
+    return sum(1 for procs in PROCS.values() for p in procs
+               if p._counts_globally())
+
+
+def _next_waiter(window_limit):
+    """Returns the waiting RustProc that should get the next free global
+    slot.  Must be called with PROCS_LOCK held."""
+    candidates = [p for p in WAITING
+                  if p._counts_globally() and
+                  (not window_limit or
+                   len(PROCS.get(p.window.id(), ())) < window_limit)]
+    if not candidates:
+        return None
+    active = sublime.active_window()
+    if active is not None:
+        for p in candidates:
+            if p.window.id() == active.id():
+                return p
+    # min() picks the earliest arrival when there is a tie.
+    return min(candidates, key=lambda p: _LAST_GRANT.get(p.window.id(), 0))
+
+
+def window_procs(window, owner=None, tag=None):
+    """Returns a list of running `RustProc` objects for the given window.
+
+    :param owner: If set, only include processes with this owner.
+    :param tag: If set, only include processes with this tag.
+    """
+    with PROCS_LOCK:
+        procs = list(PROCS.get(window.id(), ()))
+    return [p for p in procs
+            if (owner is None or p.owner is owner) and
+               (tag is None or p.tag == tag)]
+
+
+def terminate_procs(window, owner=None, tag=None):
+    """Kill the running processes for the given window.
+
+    :param owner: If set, only kill processes with this owner.
+    :param tag: If set, only kill processes with this tag.
+    """
+    for p in window_procs(window, owner=owner, tag=tag):
+        p.terminate()
+
+
+class ResourceUsage(object):
+
+    """Resources used by a finished process.
+
+    The CPU and context switch values include any child processes it waited
+    for (such as the rustc processes launched by cargo).  They are None if not
+    available (such as on Windows).
+
+    :ivar wall_time: Wall clock time in seconds.
+    :ivar user_time: User CPU time in seconds.
+    :ivar sys_time: System CPU time in seconds.
+    :ivar max_rss: Peak resident set size in bytes of the largest process.
+    :ivar voluntary_switches: Number of voluntary context switches (typically
+        waiting on I/O or a lock).
+    :ivar involuntary_switches: Number of involuntary context switches
+        (typically preempted by another process).
+    """
+
+    user_time = None
+    sys_time = None
+    max_rss = None
+    voluntary_switches = None
+    involuntary_switches = None
+
+    def __init__(self, wall_time, rusage=None):
+        self.wall_time = wall_time
+        if rusage is not None:
+            self.user_time = rusage.ru_utime
+            self.sys_time = rusage.ru_stime
+            self.max_rss = rusage.ru_maxrss
+            if sys.platform != 'darwin':
+                # Linux reports kilobytes, macOS reports bytes.
+                self.max_rss *= 1024
+            self.voluntary_switches = rusage.ru_nvcsw
+            self.involuntary_switches = rusage.ru_nivcsw
+
+    def summary(self):
+        """Short description used in the build output."""
+        if self.user_time is None:
+            return '%.1fs' % (self.wall_time,)
+        return '%.1fs, %.1fs CPU, %.0f MB peak' % (
+            self.wall_time, self.user_time + self.sys_time,
+            self.max_rss / 1048576)
+
+    def __str__(self):
+        if self.user_time is None:
+            return 'wall=%.3fs' % (self.wall_time,)
+        return ('wall=%.3fs user=%.3fs sys=%.3fs max_rss=%.1fMB '
+                'nvcsw=%i nivcsw=%i') % (
+            self.wall_time, self.user_time, self.sys_time,
+            self.max_rss / 1048576, self.voluntary_switches,
+            self.involuntary_switches)
+
+
 class RustProc(object):
 
     """Launches and controls a subprocess."""
@@ -143,11 +448,31 @@ class RustProc(object):
     start_time = None
     # Number of seconds it took to run.
     elapsed = None
+    # `ResourceUsage` once the process is finished.
+    usage = None
+    # Number of JSON lines that were not decoded because their reason was not
+    # in `json_reasons`.
+    json_skipped = 0
+    # The owner of the process, typically the `RustThread` that started it.
+    owner = None
+    # Optional string used to identify the process (such as 'check').
+    tag = None
+    # Dictionary of resource limits from `rust_job_limits`.
+    limits = None
     # The thread used for reading output.
     _stdout_thread = None
+    # Maximum number of bytes to read from the pipe at once when reading in
+    # chunked mode.
+    chunk_size = 65536
+    # One of the values documented for `SPAWN_METHOD`.
+    spawn_method = SPAWN_METHOD
+    # If True, the process does not count against (or wait for) the global
+    # process limit.
+    global_limit_exempt = False
 
     def run(self, window, cmd, cwd, listener, env=None,
-            decode_json=True, json_stop_pattern=None):
+            decode_json=True, json_stop_pattern=None, chunked=True,
+            json_reasons=None, owner=None, tag=None):
         """Run the process.
 
         :param window: Sublime window.
@@ -161,6 +486,19 @@ class RustProc(object):
             should stop looking for JSON messages.  This is used by `cargo
             run` so that it does not capture output from the user's program
             that might start with an open curly brace.
+        :param chunked: If True, output is read from the pipe in large chunks
+            and delivered to the listener in batches (see
+            `ProcListener.on_data_batch` and `ProcListener.on_json_batch`).
+            If False, output is read and delivered one line at a time.
+        :param json_reasons: Collection of cargo message reasons (such as
+            `DIAGNOSTIC_REASONS`) to decode.  Cargo messages with any other
+            reason are skipped without being decoded, and are not passed to
+            the listener.  JSON without a reason is always decoded.  If None,
+            all JSON messages are decoded.
+        :param owner: The owner of the process.  Defaults to the `RustThread`
+            running for the window.  If the owner is asked to exit, the
+            process will not be started.
+        :param tag: Optional string used to identify the process.
 
         :raises ProcessTermiantedError: Process was terminated by another
             thread.
@@ -171,52 +509,60 @@ class RustProc(object):
         self.cmd = cmd
         self.cwd = cwd
         self.listener = listener
-        self.start_time = time.time()
         self.window = window
         self.decode_json = decode_json
         self.json_stop_pattern = json_stop_pattern
+        self.chunked = chunked
+        self.json_reasons = json_reasons
+        self.json_skipped = 0
 
         from . import rust_thread
-        try:
-            t = rust_thread.THREADS[window.id()]
-        except KeyError:
-            pass
-        else:
-            if t.should_exit:
-                raise ProcessTerminatedError()
-
-        with PROCS_LOCK:
-            PROCS[window.id()] = self
-        listener.on_begin(self)
-
-        # Configure the environment.
-        self.env = os.environ.copy()
-        if util.get_setting('rust_include_shell_env', True):
-            global USER_SHELL_ENV
-            if USER_SHELL_ENV is None:
-                USER_SHELL_ENV = shellenv.get_env()[1]
-            self.env.update(USER_SHELL_ENV)
-
-        rust_env = util.get_setting('rust_env')
-        if rust_env:
-            for k, v in rust_env.items():
-                rust_env[k] = os.path.expandvars(v)
-            self.env.update(rust_env)
+        if owner is None:
+            owner = rust_thread.THREADS.get(window.id())
+        self.owner = owner
+        self.tag = tag
+        if owner is not None and owner.should_exit:
+            raise ProcessTerminatedError()
 
-        if env:
-            self.env.update(env)
+        self._acquire_slot()
+        try:
+            self.start_time = time.time()
+            listener.on_begin(self)
+            self.env = make_env(window, env)
+            self.limits = self._job_limits()
+            if self.limits.get('jobs'):
+                self.env = dict(self.env,
+                                CARGO_BUILD_JOBS=str(self.limits['jobs']))
+            log.log(window, 'Running: %s', ' '.join(self.cmd))
+            self.proc = self._popen()
+            self._apply_limits()
+        except:
+            self._release_slot()
+            raise
 
-        log.log(window, 'Running: %s', ' '.join(self.cmd))
+        self._stdout_thread = threading.Thread(target=self._read_stdout,
+            name='%s: Stdout' % (threading.current_thread().name,))
+        self._stdout_thread.start()
 
+    def _popen(self):
+        """Launch the child process, returns the `subprocess.Popen` object."""
         if sys.platform == 'win32':
             # Prevent a console window from popping up.
             startupinfo = subprocess.STARTUPINFO()
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            self.proc = subprocess.Popen(
+            nice = self.limits.get('nice')
+            if not nice:
+                creationflags = 0
+            elif nice >= 15:
+                creationflags = 0x40  # IDLE_PRIORITY_CLASS
+            else:
+                creationflags = 0x4000  # BELOW_NORMAL_PRIORITY_CLASS
+            return subprocess.Popen(
                 self.cmd,
                 cwd=self.cwd,
                 env=self.env,
                 startupinfo=startupinfo,
+                creationflags=creationflags,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
@@ -224,19 +570,115 @@ class RustProc(object):
         else:
             # Make the process the group leader so we can easily kill all its
             # children.
-            self.proc = subprocess.Popen(
+            if self.spawn_method == 'process_group':
+                kwargs = {'process_group': 0}
+            elif self.spawn_method == 'session':
+                kwargs = {'start_new_session': True}
+            else:
+                kwargs = {'preexec_fn': os.setpgrp}
+            return subprocess.Popen(
                 self.cmd,
                 cwd=self.cwd,
-                preexec_fn=os.setpgrp,
                 env=self.env,
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
+                **kwargs
             )
 
-        self._stdout_thread = threading.Thread(target=self._read_stdout,
-            name='%s: Stdout' % (threading.current_thread().name,))
-        self._stdout_thread.start()
+    def _job_limits(self):
+        """Returns the `rust_job_limits` entry for the owner's priority (an
+        empty dictionary for interactive commands)."""
+        from . import rust_thread
+        priority = getattr(self.owner, 'priority', None)
+        job_class = rust_thread.PRIORITY_NAMES.get(priority)
+        if job_class is None or job_class == 'interactive':
+            return {}
+        limits = util.get_setting('rust_job_limits', {})
+        return limits.get(job_class) or {}
+
+    def _apply_limits(self):
+        """Lower the CPU and I/O priority of the process group."""
+        if sys.platform == 'win32':
+            # Handled with creationflags.
+            return
+        nice = self.limits.get('nice')
+        if nice:
+            try:
+                os.setpriority(os.PRIO_PGRP, self.proc.pid, nice)
+            except OSError as e:
+                log.log(self.window, 'Failed to set nice level: %s', e)
+        io_class = self.limits.get('io_class')
+        if io_class:
+            try:
+                _set_io_priority(self.proc.pid, io_class)
+            except OSError as e:
+                log.log(self.window, 'Failed to set I/O priority: %s', e)
+
+    def _counts_globally(self):
+        """Whether or not this process counts against the global limit.  Only
+        check and background jobs do."""
+        from . import rust_thread
+        if self.global_limit_exempt:
+            return False
+        priority = getattr(self.owner, 'priority', None)
+        return priority in (rust_thread.PRIORITY_CHECK,
+                            rust_thread.PRIORITY_BACKGROUND)
+
+    def _acquire_slot(self):
+        """Add this process to `PROCS`, waiting if the window or the whole
+        plugin already has the maximum number of processes running.
+
+        :raises ProcessTerminatedError: The owner was asked to exit while
+            waiting.
+        """
+        limit = util.get_setting('rust_max_concurrent_processes', 4,
+                                 window=self.window)
+        global_limit = global_process_limit()
+        counted = self._counts_globally()
+        wid = self.window.id()
+        with PROCS_LOCK:
+            WAITING.append(self)
+            start = time.time()
+            waited = False
+            try:
+                while True:
+                    running = _global_count()
+                    if counted:
+                        if ((not global_limit or running < global_limit) and
+                                _next_waiter(limit) is self):
+                            break
+                    elif not limit or len(PROCS.get(wid, ())) < limit:
+                        break
+                    if self.owner is not None and self.owner.should_exit:
+                        raise ProcessTerminatedError()
+                    if not waited:
+                        log.log(self.window,
+                            'Waiting for a process slot (%i running in '
+                            'this window, %i checks running in total, %i '
+                            'waiting).',
+                            len(PROCS.get(wid, ())), running, len(WAITING))
+                        waited = True
+                    PROCS_LOCK.wait(0.1)
+                if waited:
+                    log.log(self.window, 'Waited %.3fs for a process slot.',
+                            time.time() - start)
+                PROCS.setdefault(wid, []).append(self)
+                _LAST_GRANT[wid] = next(_GRANT_COUNTER)
+            finally:
+                WAITING.remove(self)
+                PROCS_LOCK.notify_all()
+
+    def _release_slot(self):
+        """Remove this process from `PROCS`."""
+        wid = self.window.id()
+        with PROCS_LOCK:
+            procs = PROCS.get(wid, [])
+            if self in procs:
+                procs.remove(self)
+            if not procs:
+                PROCS.pop(wid, None)
+            PROCS_LOCK.notify_all()
 
     def terminate(self):
         """Kill the process.
@@ -284,31 +726,66 @@ class RustProc(object):
         return rc
 
     def _read_stdout(self):
+        if self.chunked:
+            self._read_stdout_chunked()
+        else:
+            self._read_stdout_lines()
+        rc = self._cleanup()
+        self.listener.on_finished(self, rc, self.usage)
+
+    def _read_stdout_lines(self):
         while True:
             line = self.proc.stdout.readline()
             if not line:
-                rc = self._cleanup()
-                self.listener.on_finished(self, rc)
                 break
+            self._dispatch(self._parse_lines([line]))
+
+    def _read_stdout_chunked(self):
+        partial = b''
+        while True:
+            # read1 returns whatever is available (up to chunk_size) without
+            # waiting for the buffer to fill.
+            chunk = self.proc.stdout.read1(self.chunk_size)
+            if not chunk:
+                break
+            lines = (partial + chunk).split(b'\n')
+            partial = lines.pop()
+            if lines:
+                self._dispatch(self._parse_lines(
+                    [line + b'\n' for line in lines]))
+        if partial:
+            # Final line without a trailing newline.
+            self._dispatch(self._parse_lines([partial]))
+
+    def _parse_lines(self, lines):
+        """Decode raw lines of output.
+
+        :param lines: List of lines as bytes (including the newline).
+
+        :returns: A list of `(kind, value)` tuples in the order they were
+            output.  `kind` is one of 'data', 'json', or 'error'.
+        """
+        result = []
+        for line in lines:
             try:
                 line = line.decode('utf-8')
             except:
-                self.listener.on_error(self,
-                    '[Error decoding UTF-8: %r]' % line)
+                result.append(('error', '[Error decoding UTF-8: %r]' % line))
                 continue
             if self.decode_json and line.startswith('{'):
+                if self.json_reasons is not None and \
+                        line.startswith(REASON_PREFIX):
+                    end = line.find('"', len(REASON_PREFIX))
+                    if line[len(REASON_PREFIX):end] not in self.json_reasons:
+                        self.json_skipped += 1
+                        continue
                 try:
-                    result = json.loads(line)
+                    obj = json.loads(line)
                 except:
-                    self.listener.on_error(self,
-                        '[Error loading JSON from rust: %r]' % line)
+                    result.append(('error',
+                        '[Error loading JSON from rust: %r]' % line))
                 else:
-                    try:
-                        self.listener.on_json(self, result)
-                    except:
-                        self.listener.on_error(self,
-                            'Rust Enhanced Internal Error: %s' % (
-                                traceback.format_exc(),))
+                    result.append(('json', obj))
             else:
                 if self.json_stop_pattern and \
                         re.match(self.json_stop_pattern, line):
@@ -322,16 +799,58 @@ class RustProc(object):
                     self.decode_json = False
                 # Sublime always uses \n internally.
                 line = line.replace('\r\n', '\n')
-                self.listener.on_data(self, line)
+                result.append(('data', line))
+        return result
+
+    def _dispatch(self, items):
+        """Send parsed output to the listener, grouping consecutive items of
+        the same kind into a single batch."""
+        for kind, group in itertools.groupby(items, key=lambda x: x[0]):
+            values = [value for _, value in group]
+            if kind == 'json':
+                try:
+                    self.listener.on_json_batch(self, values)
+                except:
+                    self.listener.on_error(self,
+                        'Rust Enhanced Internal Error: %s' % (
+                            traceback.format_exc(),))
+            elif kind == 'data':
+                self.listener.on_data_batch(self, values)
+            else:
+                for message in values:
+                    self.listener.on_error(self, message)
 
     def _cleanup(self):
-        self.elapsed = time.time() - self.start_time
         self.finished = True
-        self._stdout_thread = None
         self.proc.stdout.close()
-        rc = self.proc.wait()
-        with PROCS_LOCK:
-            p = PROCS.get(self.window.id())
-            if p is self:
-                del PROCS[self.window.id()]
+        rc, rusage = self._reap()
+        self.elapsed = time.time() - self.start_time
+        self.usage = ResourceUsage(self.elapsed, rusage)
+        self._stdout_thread = None
+        log.log(self.window, 'Finished (rc=%s): %s', rc, self.usage)
+        if self.json_skipped:
+            log.log(self.window, 'Skipped decoding %i JSON messages.',
+                    self.json_skipped)
+        self._release_slot()
         return rc
+
+    def _reap(self):
+        """Wait for the process to exit.
+
+        :returns: Tuple `(returncode, rusage)`.  `rusage` is None if it is
+            not available.
+        """
+        if not hasattr(os, 'wait4'):
+            return self.proc.wait(), None
+        try:
+            _, status, rusage = os.wait4(self.proc.pid, 0)
+        except ChildProcessError:
+            # Already reaped by someone else.
+            return self.proc.wait(), None
+        if os.WIFSIGNALED(status):
+            rc = -os.WTERMSIG(status)
+        else:
+            rc = os.WEXITSTATUS(status)
+        # Let Popen know the process is gone.
+        self.proc.returncode = rc
+        return rc, rusage
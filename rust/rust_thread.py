@@ -1,13 +1,201 @@
-"""Manage threads used for running Rust processes."""
+"""Manage threads used for running Rust processes.
 
-from . import util, rust_proc
+Each window has a `Scheduler` which decides which `RustThread` is allowed to
+run.  Only one thread runs at a time per window.  Threads have a priority:
+
+- `PRIORITY_INTERACTIVE`: Commands started by the user (build, run, test).
+- `PRIORITY_CHECK`: On-save syntax checking.
+- `PRIORITY_BACKGROUND`: Background work such as prefetching.
+
+A new thread preempts (terminates) a running thread of lower priority, and
+discards pending threads that it makes redundant: those doing the same work
+(see `RustThread.job_key`), and silently interruptible ones of the same or
+lower priority.  Waiting happens in the
+new thread, never on the UI thread.
+"""
+
+from . import util, rust_proc, log
 
 import sublime
 import threading
+import time
 
-# Map Sublime window ID to RustThread.
+PRIORITY_BACKGROUND = 0
+PRIORITY_CHECK = 1
+PRIORITY_INTERACTIVE = 2
+# Name of each priority, used for the `rust_job_limits` setting.
+PRIORITY_NAMES = {
+    PRIORITY_BACKGROUND: 'background',
+    PRIORITY_CHECK: 'check',
+    PRIORITY_INTERACTIVE: 'interactive',
+}
+
+# Map Sublime window ID to the running RustThread.
 THREADS = {}
-THREADS_LOCK = threading.Lock()
+# Guards THREADS and all schedulers.  Notified whenever a thread finishes or
+# the pending queue changes.
+THREADS_LOCK = threading.Condition()
+# Map Sublime window ID to Scheduler.
+SCHEDULERS = {}
+
+
+def get_scheduler(window):
+    """Returns the `Scheduler` for the given window."""
+    with THREADS_LOCK:
+        try:
+            return SCHEDULERS[window.id()]
+        except KeyError:
+            s = SCHEDULERS[window.id()] = Scheduler(window)
+            return s
+
+
+class Scheduler(object):
+
+    """Decides when the threads of a window are allowed to run."""
+
+    def __init__(self, window):
+        self.window = window
+        # List of RustThread objects waiting to run.
+        self.pending = []
+        # Incremented for each submitted thread, used to keep FIFO order
+        # within a priority.
+        self.seq = 0
+
+    @property
+    def running(self):
+        return THREADS.get(self.window.id())
+
+    def submit(self, job):
+        """Wait until `job` is allowed to run.
+
+        This is called from the job's thread.
+
+        :returns: True if the job should run, False if it was discarded.
+        """
+        with THREADS_LOCK:
+            running = self.running
+            if running is not None and not running.is_alive():
+                running = None
+            if self._is_outranked(job, running):
+                log.log(self.window, 'Scheduler: discarding %s, %s is busy.',
+                        job.name, running.name if running else 'queue')
+                return False
+            if (running is not None and not running.should_exit and
+                    job.priority == running.priority and
+                    not running.silently_interruptible and
+                    not job.wait_if_busy):
+                ask = running
+            else:
+                ask = None
+        if ask is not None:
+            # Neither is interruptible (the user started a Build while one
+            # is already running).
+            msg = """
+                Rust Build
+
+                The following Rust command is still running, do you want to cancel it?
+                %s""" % ask.describe()
+            if not sublime.ok_cancel_dialog(util.multiline_fix(msg),
+                                            'Stop Running Command'):
+                # Allow the original process to finish.
+                return False
+        with THREADS_LOCK:
+            victim = self._preempt(job)
+            self.seq += 1
+            job._seq = self.seq
+            self.pending.append(job)
+            self.pending.sort(key=lambda j: (-j.priority, j._seq))
+            log.log(self.window, 'Scheduler: %s queued (%i pending).',
+                    job.name, len(self.pending))
+            THREADS_LOCK.notify_all()
+        if victim is not None:
+            victim.terminate()
+        start = time.time()
+        with THREADS_LOCK:
+            try:
+                while True:
+                    if job.should_exit:
+                        log.log(self.window, 'Scheduler: %s discarded.',
+                                job.name)
+                        return False
+                    running = self.running
+                    first = [j for j in self.pending if not j.should_exit][0]
+                    if ((running is None or not running.is_alive()) and
+                            first is job):
+                        THREADS[self.window.id()] = job
+                        log.log(self.window,
+                            'Scheduler: starting %s after %.3fs '
+                            '(%i pending).',
+                            job.name, time.time() - start,
+                            len(self.pending) - 1)
+                        return True
+                    THREADS_LOCK.wait(0.1)
+            finally:
+                self.pending.remove(job)
+                THREADS_LOCK.notify_all()
+
+    def finished(self, job):
+        """Called from the job's thread when it is done running."""
+        with THREADS_LOCK:
+            if THREADS.get(self.window.id()) is job:
+                del THREADS[self.window.id()]
+            THREADS_LOCK.notify_all()
+
+    def cancel(self, max_priority=None):
+        """Discard all pending threads and terminate the running one.
+
+        :param max_priority: If set, only threads with this priority or
+            lower are canceled.
+
+        :returns: The running thread that was asked to exit, or None.
+        """
+        with THREADS_LOCK:
+            for job in self.pending:
+                if max_priority is None or job.priority <= max_priority:
+                    job.should_exit = True
+            running = self.running
+            if (running is not None and max_priority is not None and
+                    running.priority > max_priority):
+                running = None
+            THREADS_LOCK.notify_all()
+        if running is not None:
+            running.terminate()
+        return running
+
+    def _is_outranked(self, job, running):
+        """Whether or not `job` should be discarded because something more
+        important is running or waiting."""
+        if job.wait_if_busy:
+            return False
+        others = [j for j in self.pending if not j.should_exit]
+        if running is not None and not running.should_exit:
+            others.append(running)
+        return any(other.priority > job.priority for other in others)
+
+    def _preempt(self, job):
+        """Discard pending threads that `job` supersedes.  Must be called
+        with THREADS_LOCK held.
+
+        :returns: The running thread that should be terminated, or None.
+        """
+        for other in self.pending:
+            if (other.job_key() == job.job_key() or
+                    (other.silently_interruptible and
+                     not other.wait_if_busy and
+                     job.priority >= other.priority)):
+                log.log(self.window, 'Scheduler: %s replaced by %s.',
+                        other.name, job.name)
+                other.should_exit = True
+        running = self.running
+        if running is None or not running.is_alive() or running.should_exit:
+            return None
+        if (job.priority > running.priority or
+                (job.priority == running.priority and
+                 not job.wait_if_busy)):
+            log.log(self.window, 'Scheduler: %s preempted by %s.',
+                    running.name, job.name)
+            return running
+        return None
 
 
 class RustThread(object):
@@ -21,14 +209,22 @@ class RustThread(object):
 
     # threading.Thread instance
     thread = None
-    # If this is true, then it is OK to kill this thread to start a new one.
+    # If this is true, then it is OK to kill this thread to start a new one
+    # of the same priority.
     silently_interruptible = True
+    # One of the PRIORITY constants.
+    priority = PRIORITY_CHECK
+    # If True, the thread waits for more important threads to finish instead
+    # of being discarded.
+    wait_if_busy = False
     # Set to True when the thread should terminate.
     should_exit = False
     # Sublime window this thread is attached to.
     window = None
     # Name of the thread.
     name = None
+    # Order of submission to the scheduler.
+    _seq = 0
 
     def __init__(self, window):
         self.window = window
@@ -39,10 +235,25 @@ class RustThread(object):
             target=self._thread_run)
         self.thread.start()
 
+    def job_key(self):
+        """Returns a value identifying the work this thread does.  Pending
+        threads with the same key are merged."""
+        return (self.__class__.__name__,)
+
+    @property
+    def current_procs(self):
+        """List of `RustProc` objects being executed by this thread."""
+        return rust_proc.window_procs(self.window, owner=self)
+
     @property
     def current_proc(self):
-        """The current `RustProc` being executed by this thread, or None."""
-        return rust_proc.PROCS.get(self.window.id(), None)
+        """The most recent `RustProc` being executed by this thread, or
+        None."""
+        procs = self.current_procs
+        if procs:
+            return procs[-1]
+        else:
+            return None
 
     def describe(self):
         """Returns a string with the name of the thread."""
@@ -53,60 +264,30 @@ class RustThread(object):
             return self.name
 
     def _thread_run(self):
-        # Determine if this thread is allowed to run.
-        while True:
-            with THREADS_LOCK:
-                t = THREADS.get(self.window.id(), None)
-                if not t or not t.is_alive():
-                    THREADS[self.window.id()] = self
-                    break
-
-            # Another thread is already running for this window.
-            if t.should_exit:
-                t.join()
-            elif t.silently_interruptible:
-                t.terminate()
-                t.join()
-            elif self.silently_interruptible:
-                # Never allowed to interrupt.
-                return
-            else:
-                # Neither is interruptible (the user started a Build
-                # while one is already running).
-                msg = """
-                    Rust Build
-
-                    The following Rust command is still running, do you want to cancel it?
-                    %s""" % self.describe()
-                if sublime.ok_cancel_dialog(util.multiline_fix(msg),
-                                            'Stop Running Command'):
-                    t.terminate()
-                    t.join()
-                else:
-                    # Allow the original process to finish.
-                    return
-            # Try again.
-
+        scheduler = get_scheduler(self.window)
+        if not scheduler.submit(self):
+            return
         try:
             self.run()
         finally:
-            with THREADS_LOCK:
-                t = THREADS.get(self.window.id(), None)
-                if t is self:
-                    del THREADS[self.window.id()]
+            scheduler.finished(self)
 
     def run(self):
         raise NotImplementedError()
 
-    def terminate(self):
+    def terminate(self, tag=None):
         """Asks the thread to exit.
 
-        If the thread is running a process, the process will be killed.
+        If the thread is running any processes, they will be killed.
+
+        :param tag: If set, only kill the processes of this thread with the
+            given tag, and allow the thread to continue running.
         """
-        self.should_exit = True
-        p = self.current_proc
-        if p and not p.finished:
-            p.terminate()
+        if tag is None:
+            self.should_exit = True
+            with THREADS_LOCK:
+                THREADS_LOCK.notify_all()
+        rust_proc.terminate_procs(self.window, owner=self, tag=tag)
 
     def is_alive(self):
         return self.thread.is_alive()
@@ -0,0 +1,256 @@
+"""Shadow copy of a workspace, used for checking unsaved changes.
+
+Files with unsaved changes in Sublime are written with their buffer
+contents.  The other files Cargo reads to build the workspace (Rust
+sources, manifests, the lock file and Cargo config) are mirrored with a
+copy-on-write clone where the filesystem supports it, and a copy otherwise.
+Hard links are not used, since a tool that writes to a file in place would
+modify the real file.  Everything else (such as files used with
+`include_str!`) is only read by the compiler, and is symlinked to the real
+file.
+
+It is kept up to date incrementally: only directories whose modification
+time changed are listed again, and only files that changed since the last
+sync are replaced.
+
+Paths in messages from Cargo running in the shadow tree can be mapped back
+to the real files with `ShadowTree.from_shadow` and `map_message`.
+"""
+
+import hashlib
+import os
+import shutil
+import stat
+import sys
+import threading
+import sublime
+
+from . import util, log
+
+# Names of files (other than Rust sources) that are mirrored instead of
+# symlinked.
+CARGO_FILES = ('Cargo.toml', 'Cargo.lock')
+# `FICLONE` ioctl from <linux/fs.h>.
+FICLONE = 0x40049409
+
+# Map workspace root to ShadowTree.
+_trees = {}
+_trees_lock = threading.Lock()
+
+
+def get_shadow(root):
+    """Returns the `ShadowTree` for the given workspace root."""
+    with _trees_lock:
+        try:
+            return _trees[root]
+        except KeyError:
+            tree = _trees[root] = ShadowTree(root)
+            return tree
+
+
+def _is_cargo_file(rel):
+    """Whether or not a file (relative to the workspace root) is read by
+    Cargo, and must be mirrored rather than symlinked."""
+    name = os.path.basename(rel)
+    return (name.endswith('.rs') or name in CARGO_FILES or
+            os.path.basename(os.path.dirname(rel)) == '.cargo')
+
+
+def _clone_file(src, dst):
+    """Create dst as a copy-on-write clone of src.
+
+    :returns: False if the platform or filesystem does not support it.
+    """
+    if sys.platform.startswith('linux'):
+        import fcntl
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except (OSError, IOError):
+            try:
+                os.unlink(dst)
+            except OSError:
+                pass
+            return False
+    elif sys.platform == 'darwin':
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clonefile = getattr(libc, 'clonefile', None)
+        if clonefile is None:
+            return False
+        return clonefile(src.encode('utf-8'), dst.encode('utf-8'), 0) == 0
+    return False
+
+
+class ShadowTree(object):
+
+    """A mirror of a workspace directory with unsaved buffers applied."""
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        key = hashlib.sha1(self.root.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(sublime.cache_path(), util.PACKAGE_NAME,
+                                 'shadow', key)
+        # Target directory for Cargo running in the shadow tree.
+        self.target_dir = self.path + '-target'
+        # Map a path relative to the root to a signature of what was last
+        # written to the shadow tree.
+        self.files = {}
+        # Map a directory relative to the root ('' for the root) to
+        # (mtime, file names, subdirectory names) as of its last listing.
+        self.dirs = {}
+        self.lock = threading.Lock()
+
+    def to_shadow(self, path):
+        """Convert a path in the workspace to the shadow tree."""
+        return os.path.join(self.path, os.path.relpath(path, self.root))
+
+    def from_shadow(self, path):
+        """Convert a path in the shadow tree to the workspace.  Other paths
+        are returned unchanged."""
+        if path == self.path or path.startswith(self.path + os.sep):
+            return os.path.join(self.root, os.path.relpath(path, self.path))
+        return path
+
+    def sync(self, window, buffers):
+        """Bring the shadow tree up to date.
+
+        :param window: Sublime window, used for logging.
+        :param buffers: Dictionary of {absolute path: text} of files with
+            unsaved changes.
+        """
+        with self.lock:
+            seen = set()
+            changed = 0
+            for rel in self._list_files():
+                src = os.path.join(self.root, rel)
+                seen.add(rel)
+                if src in buffers:
+                    text = buffers[src]
+                    sig = ('buffer', hashlib.sha1(
+                        text.encode('utf-8')).hexdigest())
+                    if self.files.get(rel) != sig:
+                        self._write(rel, text)
+                        changed += 1
+                elif not _is_cargo_file(rel):
+                    # The link follows changes to the real file.
+                    sig = ('link',)
+                    if self.files.get(rel) != sig:
+                        self._link(src, rel)
+                        changed += 1
+                else:
+                    try:
+                        st = os.stat(src)
+                    except OSError:
+                        continue
+                    sig = ('file', st.st_ino, st.st_mtime, st.st_size)
+                    if self.files.get(rel) != sig:
+                        self._mirror(src, rel)
+                        changed += 1
+                self.files[rel] = sig
+            removed = set(self.files) - seen
+            for rel in removed:
+                self._remove(rel)
+                del self.files[rel]
+            log.log(window, 'Shadow tree %s: %i files updated, %i removed.',
+                    self.path, changed, len(removed))
+
+    def _list_files(self):
+        """Returns the paths (relative to the root) of all files in the
+        workspace.  Directories are only listed again if their modification
+        time changed since the previous call."""
+        result = []
+        seen_dirs = set()
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            full = os.path.join(self.root, rel)
+            try:
+                mtime = os.stat(full).st_mtime_ns
+            except OSError:
+                continue
+            entry = self.dirs.get(rel)
+            if entry is None or entry[0] != mtime:
+                files = []
+                subdirs = []
+                try:
+                    names = os.listdir(full)
+                except OSError:
+                    continue
+                for name in names:
+                    try:
+                        mode = os.lstat(os.path.join(full, name)).st_mode
+                    except OSError:
+                        continue
+                    if stat.S_ISDIR(mode):
+                        if name not in util.SKIP_DIRS:
+                            subdirs.append(name)
+                    elif not (stat.S_ISLNK(mode) and
+                              os.path.isdir(os.path.join(full, name))):
+                        # Like os.walk, links to directories are not
+                        # followed.
+                        files.append(name)
+                entry = self.dirs[rel] = (mtime, files, subdirs)
+            seen_dirs.add(rel)
+            result.extend(os.path.join(rel, name) for name in entry[1])
+            stack.extend(os.path.join(rel, name) for name in entry[2])
+        for rel in set(self.dirs) - seen_dirs:
+            del self.dirs[rel]
+        return result
+
+    def _shadow_path(self, rel):
+        dst = os.path.join(self.path, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        return dst
+
+    def _remove(self, rel):
+        try:
+            os.unlink(os.path.join(self.path, rel))
+        except FileNotFoundError:
+            pass
+
+    def _mirror(self, src, rel):
+        dst = self._shadow_path(rel)
+        # Replace rather than overwrite, in case it is a link.
+        self._remove(rel)
+        if _clone_file(src, dst):
+            shutil.copystat(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+    def _link(self, src, rel):
+        dst = self._shadow_path(rel)
+        self._remove(rel)
+        try:
+            os.symlink(src, dst)
+        except (OSError, NotImplementedError):
+            # Such as Windows without the symlink privilege.
+            shutil.copy2(src, dst)
+
+    def _write(self, rel, text):
+        dst = self._shadow_path(rel)
+        self._remove(rel)
+        with open(dst, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+
+    def map_message(self, obj):
+        """Convert shadow tree paths in a Cargo JSON message to the real
+        paths, in place."""
+        target = obj.get('target')
+        if target and target.get('src_path'):
+            target['src_path'] = self.from_shadow(target['src_path'])
+        message = obj.get('message')
+        if message:
+            self._map_diagnostic(message)
+
+    def _map_diagnostic(self, diagnostic):
+        for span in diagnostic.get('spans', []):
+            while span:
+                if span.get('file_name'):
+                    span['file_name'] = self.from_shadow(span['file_name'])
+                expansion = span.get('expansion')
+                span = expansion.get('span') if expansion else None
+        for child in diagnostic.get('children', []):
+            self._map_diagnostic(child)
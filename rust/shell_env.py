@@ -0,0 +1,147 @@
+"""Environment from the user's login shell.
+
+Capturing the environment requires launching a login shell, which can take a
+while if the shell's startup files do a lot of work.  The environment is
+cached on disk, keyed by the shell path and the modification times of the
+shell's startup files, and is loaded in the background when the plugin is
+loaded.
+"""
+
+import json
+import os
+import sys
+import threading
+import shellenv
+import sublime
+import sublime_plugin
+
+from . import util
+
+# Startup files read by a login shell, keyed by the shell name.
+RC_FILES = {
+    'bash': ['/etc/profile', '~/.bash_profile', '~/.bash_login', '~/.profile',
+             '~/.bashrc'],
+    'zsh': ['/etc/zshenv', '/etc/zprofile', '/etc/zshrc', '/etc/zlogin',
+            '~/.zshenv', '~/.zprofile', '~/.zshrc', '~/.zlogin'],
+    'fish': ['/etc/fish/config.fish', '~/.config/fish/config.fish'],
+}
+DEFAULT_RC_FILES = ['/etc/profile', '~/.profile']
+
+# Environment (as a dict) from the user's login shell.  None if not loaded.
+_env = None
+# Incremented whenever the cached environment is discarded.
+generation = 0
+# Held while the environment is being loaded so that only one shell is
+# launched at a time.
+_lock = threading.Lock()
+
+
+def get_env():
+    """Returns the environment of the user's login shell as a dict.
+
+    This will block if the environment is not cached.
+    """
+    global _env
+    with _lock:
+        if _env is None:
+            _env = _load_cache()
+            if _env is None:
+                _env = _capture()
+        return _env
+
+
+def refresh_async():
+    """Load the environment in a background thread.
+
+    If the on-disk cache is out of date, the login shell is launched to
+    capture a new copy.
+    """
+    t = threading.Thread(target=get_env, name='Rust Shell Env')
+    t.start()
+
+
+def clear():
+    """Remove the cached environment (in memory and on disk)."""
+    global _env, generation
+    with _lock:
+        _env = None
+        generation += 1
+        try:
+            os.unlink(_cache_file())
+        except FileNotFoundError:
+            pass
+
+
+def _cache_file():
+    return os.path.join(sublime.cache_path(), util.PACKAGE_NAME,
+                        'shell_env.json')
+
+
+def _login_shell():
+    import pwd
+    try:
+        return pwd.getpwuid(os.getuid()).pw_shell
+    except KeyError:
+        return os.environ.get('SHELL', '')
+
+
+def _cache_key():
+    """Returns a dictionary that identifies the current shell
+    configuration."""
+    shell = _login_shell()
+    rc_files = RC_FILES.get(os.path.basename(shell), DEFAULT_RC_FILES)
+    mtimes = {}
+    for path in rc_files:
+        path = os.path.expanduser(path)
+        mtimes[path] = util.file_mtime(path)
+    return {'shell': shell, 'mtimes': mtimes}
+
+
+def _load_cache():
+    if sys.platform == 'win32':
+        # The Windows environment is read from the registry, which is fast
+        # and does not have any startup files to detect changes.
+        return None
+    try:
+        with open(_cache_file(), encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('key') != _cache_key():
+        return None
+    return data.get('env')
+
+
+def _capture():
+    if sys.platform == 'win32':
+        return shellenv.get_env()[1]
+    # Compute the key first so that any changes made while the shell is
+    # running are detected next time.
+    key = _cache_key()
+    env = shellenv.get_env()[1]
+    path = _cache_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'env': env}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print('Rust Enhanced: Failed to save shell environment cache: %s' % (e,))
+    return env
+
+
+class RustClearShellEnvCacheCommand(sublime_plugin.WindowCommand):
+
+    """Discards the cached login shell environment and captures it again."""
+
+    def run(self):
+        # `clear` waits for a capture that is in progress, which may take a
+        # while, so do it all in the background.
+        t = threading.Thread(target=_clear_and_refresh, name='Rust Shell Env')
+        t.start()
+
+
+def _clear_and_refresh():
+    clear()
+    get_env()
@@ -35,8 +35,14 @@ class TargetDetector(object):
             metadata = util.get_cargo_metadata(self.window, os.path.dirname(file_name))
             if not metadata:
                 return []
-        # Each "workspace" shows up as a separate package.
-        for package in metadata['packages']:
+        # Each "workspace" shows up as a separate package.  Check the
+        # package that owns the file first.
+        owner = self.find_package(file_name, metadata)
+        packages = list(metadata['packages'])
+        if owner is not None:
+            packages.remove(owner)
+            packages.insert(0, owner)
+        for package in packages:
             root_path = os.path.dirname(package['manifest_path'])
             targets = package['targets']
             # targets is list of dictionaries:
@@ -64,6 +70,49 @@ class TargetDetector(object):
             'Rust Enhanced: Failed to find target for %r', file_name)
         return [(None, [])]
 
+    def find_package(self, file_name, metadata):
+        """Find the workspace member that contains the given file.
+
+        :param metadata: Output from `get_cargo_metadata`.
+
+        :returns: The package dictionary from metadata whose manifest
+            directory is the closest parent of file_name, or None.
+        """
+        result = None
+        result_dir = ''
+        for package in metadata['packages']:
+            package_dir = os.path.dirname(package['manifest_path'])
+            if (file_name.startswith(package_dir + os.sep) and
+                    len(package_dir) > len(result_dir)):
+                result = package
+                result_dir = package_dir
+        return result
+
+    def reverse_dependents(self, package_name, metadata):
+        """Find the workspace members that depend on the given package,
+        directly or indirectly.
+
+        :param metadata: Output from `get_cargo_metadata`.
+
+        :returns: List of package names, sorted.
+        """
+        members = set(package['name'] for package in metadata['packages'])
+        # Map a package name to the names of members that depend on it.
+        dependents = {}
+        for package in metadata['packages']:
+            for dep in package.get('dependencies', []):
+                if dep['name'] in members:
+                    dependents.setdefault(dep['name'], set()).add(
+                        package['name'])
+        result = set()
+        todo = [package_name]
+        while todo:
+            for name in dependents.get(todo.pop(), ()):
+                if name not in result and name != package_name:
+                    result.add(name)
+                    todo.append(name)
+        return sorted(result)
+
     def _targets_manual_config(self, file_name):
         """Check for Cargo targets in the Sublime settings."""
         # First check config for manual targets.
@@ -79,7 +128,7 @@ class TargetDetector(object):
                 target = targets.get('_default', '')
                 if target:
                     # Unfortunately don't have the target src filename.
-                    return [('', target)]
+                    return [('', target.split())]
         return None
 
     def _target_to_args(self, target):
@@ -7,6 +7,15 @@ import os
 
 PACKAGE_NAME = __package__.split('.')[0]
 
+# Settings files read by `get_setting`, in order.  Used to register
+# `add_on_change` callbacks.
+SETTINGS_FILES = ('RustEnhanced.sublime-settings',
+                  'Preferences.sublime-settings')
+
+# Directories of a workspace that never contain sources (build output and
+# version control).
+SKIP_DIRS = ('target', '.git', '.hg', '.svn')
+
 
 def index_with(l, cb):
     """Find the index of a value in a sequence using a callback.
@@ -27,38 +36,36 @@ def multiline_fix(s):
     return textwrap.dedent(s).lstrip()
 
 
-def get_setting(name, default=None):
-    """Retrieve a setting from Sublime settings."""
-    pdata = sublime.active_window().project_data()
+def get_setting(name, default=None, window=None):
+    """Retrieve a setting from Sublime settings.
+
+    :param window: Window whose project settings are checked first.  Defaults
+        to the active window.
+    """
+    if window is None:
+        window = sublime.active_window()
+    pdata = window.project_data()
     if pdata:
         v = pdata.get('settings', {}).get(name)
         if v is not None:
             return v
-    settings = sublime.load_settings('RustEnhanced.sublime-settings')
-    v = settings.get(name)
-    if v is not None:
-        return v
-    settings = sublime.load_settings('Preferences.sublime-settings')
     # XXX: Also check "Distraction Free"?
-    return settings.get(name, default)
+    for settings_file in SETTINGS_FILES:
+        v = sublime.load_settings(settings_file).get(name)
+        if v is not None:
+            return v
+    return default
 
 
 def get_rustc_version(window, cwd, toolchain=None):
     """Returns the rust version for the given directory.
 
+    The result is cached, see the `versions` module.
+
     :Returns: A string such as '1.16.0' or '1.17.0-nightly'.
     """
-    from . import rust_proc
-    cmd = ['rustc']
-    if toolchain:
-        cmd.append('+' + toolchain)
-    cmd.append('--version')
-    output = rust_proc.check_output(window, cmd, cwd)
-    # Example outputs:
-    # rustc 1.15.1 (021bd294c 2017-02-08)
-    # rustc 1.16.0-beta.2 (bc15d5281 2017-02-16)
-    # rustc 1.17.0-nightly (306035c21 2017-02-18)
-    return output.split()[1]
+    from . import versions
+    return versions.get_rustc_version(window, cwd, toolchain=toolchain)
 
 
 def find_cargo_manifest(path):
@@ -69,16 +76,33 @@ def find_cargo_manifest(path):
     path = os.path.normpath(path)
     if os.path.isfile(path):
         path = os.path.dirname(path)
-    while True:
+    for path in parent_dirs(path):
         manifest = os.path.join(path, 'Cargo.toml')
         if os.path.exists(manifest):
             return path
+    return None
+
+
+def parent_dirs(path):
+    """Yields the given directory and each of its parents, up to the root."""
+    path = os.path.normpath(path)
+    while True:
+        yield path
         parent = os.path.dirname(path)
         if parent == path:
-            return None
+            return
         path = parent
 
 
+def file_mtime(path):
+    """Returns the modification time of a file, or None if it does not
+    exist."""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
 def active_view_is_rust(window=None, view=None):
     """Determine if the current view is a Rust source file.
 
@@ -124,20 +148,12 @@ def get_cargo_metadata(window, cwd, toolchain=None):
                     - Executables: 'bin', 'test', 'example', 'bench'
                     - build.rs: 'custom-build'
 
+    The result is cached, see the `metadata` module.
+
     :raises ProcessTermiantedError: Process was terminated by another thread.
     """
-    from . import rust_proc
-    cmd = ['cargo']
-    if toolchain:
-        cmd.append('+' + toolchain)
-    cmd.extend(['metadata', '--no-deps'])
-    output = rust_proc.slurp_json(window,
-                                  cmd,
-                                  cwd=cwd)
-    if output:
-        return output[0]
-    else:
-        return None
+    from . import metadata
+    return metadata.get_cargo_metadata(window, cwd, toolchain=toolchain)
 
 
 def icon_path(level, res=None):
@@ -0,0 +1,168 @@
+"""Cache of rustc versions.
+
+The rustc version is needed for every build and on-save check.  Instead of
+running `rustc --version` each time, the result is cached keyed by the
+toolchain and the rustc executable that would be run (along with its
+modification time and the rustup state), so rustc is only launched again
+after the toolchain changes (such as with `rustup update`).
+"""
+
+import collections
+import json
+import os
+import shutil
+import threading
+import sublime
+
+from . import util, semver
+
+# Features that depend on the rustc version.  Maps a capability name to a
+# semver match expression.
+CAPABILITIES = {
+    # `--profile=test` works with `cargo check`.
+    'check_test_profile': '>=1.23.0',
+    # Columns in messages are 1-based.
+    'one_based_columns': '>=1.24.0-beta',
+}
+
+# Maximum number of versions remembered on disk.
+MAX_DISK_ENTRIES = 100
+
+# Map cache key (a string) to the version string.
+_versions = collections.OrderedDict()
+# Map version string to a dictionary of {capability: bool}.
+_capabilities = {}
+_lock = threading.Lock()
+# Whether or not the on-disk cache has been loaded.
+_loaded = False
+
+
+def get_rustc_version(window, cwd, toolchain=None):
+    """Returns the rust version for the given directory.
+
+    :Returns: A string such as '1.16.0' or '1.17.0-nightly'.
+    """
+    key = _cache_key(window, cwd, toolchain)
+    with _lock:
+        _load()
+        version = _versions.get(key)
+    if version is None:
+        version = _run_rustc_version(window, cwd, toolchain)
+        with _lock:
+            _versions[key] = version
+            _precompute(version)
+            _save()
+    return version
+
+
+def has_capability(version, name):
+    """Returns whether or not the given rustc version supports a feature.
+
+    :param version: A version string from `get_rustc_version`.
+    :param name: A key from `CAPABILITIES`.
+    """
+    try:
+        caps = _capabilities[version]
+    except KeyError:
+        caps = _precompute(version)
+    return caps[name]
+
+
+def _precompute(version):
+    caps = {name: semver.match(version, expr)
+            for name, expr in CAPABILITIES.items()}
+    _capabilities[version] = caps
+    return caps
+
+
+def _run_rustc_version(window, cwd, toolchain):
+    from . import rust_proc
+    cmd = ['rustc']
+    if toolchain:
+        cmd.append('+' + toolchain)
+    cmd.append('--version')
+    output = rust_proc.check_output(window, cmd, cwd)
+    # Example outputs:
+    # rustc 1.15.1 (021bd294c 2017-02-08)
+    # rustc 1.16.0-beta.2 (bc15d5281 2017-02-16)
+    # rustc 1.17.0-nightly (306035c21 2017-02-18)
+    return output.split()[1]
+
+
+def _toolchain_file(cwd):
+    """Find a rust-toolchain file that overrides the toolchain in cwd."""
+    for path in util.parent_dirs(cwd):
+        for name in ('rust-toolchain', 'rust-toolchain.toml'):
+            fn = os.path.join(path, name)
+            mtime = util.file_mtime(fn)
+            if mtime is not None:
+                return [fn, mtime]
+    return None
+
+
+def _rustup_stamp(env):
+    """Modification times that change whenever rustup installs, updates, or
+    changes the default toolchain."""
+    rustup_home = env.get('RUSTUP_HOME',
+                          os.path.join(os.path.expanduser('~'), '.rustup'))
+    hashes = os.path.join(rustup_home, 'update-hashes')
+    try:
+        names = os.listdir(hashes)
+    except OSError:
+        names = []
+    hash_mtimes = [util.file_mtime(os.path.join(hashes, name))
+                   for name in names]
+    return [util.file_mtime(os.path.join(rustup_home, 'settings.toml')),
+            util.file_mtime(os.path.join(rustup_home, 'toolchains')),
+            max([m for m in hash_mtimes if m is not None] or [None])]
+
+
+def _cache_key(window, cwd, toolchain):
+    from . import rust_proc
+    env = rust_proc.make_env(window)
+    rustc = shutil.which('rustc', path=env.get('PATH'))
+    key = [toolchain or '', env.get('RUSTUP_TOOLCHAIN', ''),
+           rustc, util.file_mtime(rustc) if rustc else None,
+           _rustup_stamp(env)]
+    if not toolchain:
+        # Without an explicit toolchain, it may be overridden per directory.
+        key.append(_toolchain_file(cwd))
+    return json.dumps(key)
+
+
+def _cache_file():
+    return os.path.join(sublime.cache_path(), util.PACKAGE_NAME,
+                        'rustc_versions.json')
+
+
+def _load():
+    global _loaded
+    if _loaded:
+        return
+    _loaded = True
+    if not util.get_setting('rust_rustc_version_disk_cache', True):
+        return
+    try:
+        with open(_cache_file(), encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    for key, version in data:
+        _versions[key] = version
+        _precompute(version)
+
+
+def _save():
+    if not util.get_setting('rust_rustc_version_disk_cache', True):
+        return
+    while len(_versions) > MAX_DISK_ENTRIES:
+        _versions.popitem(last=False)
+    path = _cache_file()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(_versions.items()), f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print('Rust Enhanced: Failed to save rustc version cache: %s' % (e,))
@@ -0,0 +1,216 @@
+"""Watch a workspace for changes made outside of Sublime.
+
+Uses inotify on Linux, and otherwise polls the modification times of the
+files.  Bursts of changes (such as `git checkout`) are collected and
+reported together once things have been quiet for a moment.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from . import util, log
+
+# inotify constants from <sys/inotify.h>.
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_interesting(path):
+    """Whether or not a change to the given file can affect a check."""
+    name = os.path.basename(path)
+    return (name.endswith('.rs') or name == 'Cargo.toml' or
+            (name in ('config', 'config.toml') and
+             os.path.basename(os.path.dirname(path)) == '.cargo'))
+
+
+class Watcher(object):
+
+    """Watches a directory tree in a background thread.
+
+    :param root: The directory to watch.
+    :param callback: Called (from the watcher thread) with a set of changed
+        file paths after a burst of changes.  If changes were lost (such as
+        when the inotify queue overflows), the set contains just `root`.
+    :param delay: Seconds without changes before the callback is called.
+    :param poll_interval: Seconds between scans when polling.
+    :param window: Sublime window used for logging.
+    """
+
+    # The method in use, 'inotify' or 'poll'.
+    method = None
+
+    def __init__(self, root, callback, delay=0.5, poll_interval=2.0,
+                 window=None):
+        self.root = root
+        self.window = window
+        self.callback = callback
+        self.delay = delay
+        self.poll_interval = poll_interval
+        self.should_exit = False
+        self._pending = set()
+        self._last_change = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+            name='Rust Watcher: %s' % (self.root,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.should_exit = True
+
+    def _run(self):
+        inotify = _Inotify.create() if sys.platform == 'linux' else None
+        if inotify is not None:
+            try:
+                self.method = 'inotify'
+                self._run_inotify(inotify)
+                return
+            except OSError as e:
+                # Typically ENOSPC when out of watches.
+                log.critical(self.window,
+                    'Rust Enhanced: inotify failed (%s), polling %s',
+                    e, self.root)
+            finally:
+                inotify.close()
+        self.method = 'poll'
+        self._run_poll()
+
+    def _changed(self, paths):
+        self._pending.update(paths)
+        self._last_change = time.time()
+
+    def _flush(self):
+        if self._pending and time.time() - self._last_change >= self.delay:
+            pending = self._pending
+            self._pending = set()
+            self.callback(pending)
+
+    def _walk_dirs(self, top):
+        for dirpath, dirs, files in os.walk(top):
+            dirs[:] = [d for d in dirs if d not in util.SKIP_DIRS]
+            yield dirpath, files
+
+    def _run_inotify(self, inotify):
+        # Map watch descriptor to directory.
+        wds = {}
+
+        def add_tree(top):
+            for dirpath, _ in self._walk_dirs(top):
+                wds[inotify.add_watch(dirpath, WATCH_MASK)] = dirpath
+
+        add_tree(self.root)
+        while not self.should_exit:
+            r, _, _ = select.select([inotify.fd], [], [], self.delay / 2)
+            if r:
+                for wd, mask, name in inotify.read_events():
+                    if mask & IN_Q_OVERFLOW:
+                        self._changed([self.root])
+                        continue
+                    dirpath = wds.get(wd)
+                    if dirpath is None or not name:
+                        continue
+                    path = os.path.join(dirpath, name)
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO) and \
+                                name not in util.SKIP_DIRS:
+                            add_tree(path)
+                            # Files may have been added before the watch.
+                            self._changed(
+                                os.path.join(d, f)
+                                for d, files in self._walk_dirs(path)
+                                for f in files if is_interesting(f))
+                    elif is_interesting(path):
+                        self._changed([path])
+            self._flush()
+
+    def _scan(self):
+        result = {}
+        for dirpath, files in self._walk_dirs(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if is_interesting(path):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    result[path] = (st.st_mtime, st.st_size)
+        return result
+
+    def _run_poll(self):
+        previous = self._scan()
+        while not self.should_exit:
+            time.sleep(self.poll_interval)
+            current = self._scan()
+            changed = [path for path in set(previous) | set(current)
+                       if previous.get(path) != current.get(path)]
+            if changed:
+                self._changed(changed)
+            previous = current
+            self._flush()
+
+
+class _Inotify(object):
+
+    """Minimal ctypes wrapper around the Linux inotify API."""
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+
+    @classmethod
+    def create(cls):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            return None
+        fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        return cls(libc, fd)
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read_events(self):
+        """Returns a list of (wd, mask, name) tuples."""
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,105 @@
+"""Benchmarks for looking up messages in a file with many diagnostics.
+
+These are not run as part of the normal test suite.  To run them, use the
+UnitTesting plugin with the pattern `bench*.py`.
+"""
+
+import time
+import tempfile
+from rust_test_common import *
+
+
+class BenchMessages(TestBase):
+
+    num_messages = 5000
+
+    def setUp(self):
+        super(BenchMessages, self).setUp()
+        self._override_setting('rust_phantom_style', 'none')
+        self.source = tempfile.NamedTemporaryFile(mode='w', suffix='.rs',
+                                                  delete=False)
+        for i in range(self.num_messages):
+            self.source.write('    let unused_%i = %i;\n' % (i, i))
+        self.source.close()
+
+    def tearDown(self):
+        super(BenchMessages, self).tearDown()
+        window = sublime.active_window()
+        messages.clear_messages(window)
+        view = window.find_open_file(self.source.name)
+        if view:
+            view.set_scratch(True)
+            view.close()
+        os.unlink(self.source.name)
+
+    def _open(self):
+        window = sublime.active_window()
+        view = window.open_file(self.source.name)
+        for n in range(500):
+            if not view.is_loading():
+                break
+            time.sleep(0.01)
+        else:
+            raise AssertionError('View never loaded.')
+        for i in range(self.num_messages):
+            msg = messages.Message()
+            msg.path = self.source.name
+            msg.level = messages.LEVELS['warning']
+            msg.text = 'unused variable: `unused_%i`' % (i,)
+            msg.span = ((i, 8), (i, 16))
+            messages.add_message(window, msg)
+        messages.messages_finished(window)
+        return view
+
+    def _linear_batches_at_point(self, view, point):
+        """The lookup before the message index was added."""
+        store = messages.WINDOW_MESSAGES[view.window().id()]
+        return [batch for batch in store.batches(view.file_name())
+                if any(msg.sublime_region(view).contains(point)
+                       for msg in batch)]
+
+    def _per_lookup(self, f, view, points):
+        start = time.time()
+        for point in points:
+            f(view, point)
+        return (time.time() - start) / len(points)
+
+    def test_lookup(self):
+        view = self._open()
+        points = [view.text_point(row, 10)
+                  for row in range(0, self.num_messages, 97)]
+
+        linear = self._per_lookup(self._linear_batches_at_point, view, points)
+        start = time.time()
+        messages.batches_at_point(view, points[0], sublime.HOVER_TEXT)
+        build = time.time() - start
+
+        def indexed(view, point):
+            batches = messages.batches_at_point(view, point,
+                                                sublime.HOVER_TEXT)
+            self.assertEqual(len(batches), 1)
+        lookup = self._per_lookup(indexed, view, points)
+
+        def gutter(view, point):
+            messages.batches_at_point(view, point, sublime.HOVER_GUTTER)
+        gutter_lookup = self._per_lookup(gutter, view, points)
+
+        print('Messages linear lookup:  %8.3f ms' % (linear * 1000,))
+        print('Messages index build:    %8.3f ms' % (build * 1000,))
+        print('Messages indexed lookup: %8.3f ms' % (lookup * 1000,))
+        print('Messages gutter lookup:  %8.3f ms' % (gutter_lookup * 1000,))
+
+    def test_lookup_after_edit(self):
+        view = self._open()
+        point = view.text_point(self.num_messages - 1, 10)
+        messages.batches_at_point(view, point, sublime.HOVER_TEXT)
+        # Insert a line at the top, which moves every region.
+        view.run_command('insert', {'characters': '\n'})
+        point = view.text_point(self.num_messages, 10)
+        start = time.time()
+        batches = messages.batches_at_point(view, point, sublime.HOVER_TEXT)
+        elapsed = time.time() - start
+        self.assertEqual(len(batches), 1)
+        self.assertIn('unused_%i' % (self.num_messages - 1,),
+                      batches[0].first().text)
+        print('Messages lookup after edit: %8.3f ms' % (elapsed * 1000,))
@@ -0,0 +1,101 @@
+"""Benchmarks for reading process output.
+
+These are not run as part of the normal test suite.  To run them, use the
+UnitTesting plugin with the pattern `bench*.py`.
+"""
+
+import json
+import time
+import tempfile
+from rust_test_common import *
+
+
+# Representative `cargo build --message-format=json` line.
+ARTIFACT = {
+    'reason': 'compiler-artifact',
+    'package_id': 'foo 0.1.0 (path+file:///path/to/foo)',
+    'target': {'kind': ['lib'], 'crate_types': ['lib'], 'name': 'foo',
+               'src_path': '/path/to/foo/src/lib.rs', 'edition': '2018'},
+    'profile': {'opt_level': '0', 'debuginfo': 2, 'debug_assertions': True,
+                'overflow_checks': True, 'test': False},
+    'features': [],
+    'filenames': ['/path/to/target/debug/deps/libfoo-%i.rlib' % i
+                  for i in range(10)],
+    'executable': None,
+    'fresh': True,
+}
+
+
+class BenchRustProc(TestBase):
+
+    num_lines = 100000
+
+    def setUp(self):
+        super(BenchRustProc, self).setUp()
+        self.output = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        # Cargo emits compact JSON.
+        line = json.dumps(ARTIFACT, separators=(',', ':')) + '\n'
+        for i in range(self.num_lines):
+            self.output.write(line if i % 2 else 'Compiling foo v0.1.0\n')
+        self.output.close()
+
+    def tearDown(self):
+        super(BenchRustProc, self).tearDown()
+        os.unlink(self.output.name)
+
+    def _lines_per_second(self, chunked, json_reasons=None):
+        window = sublime.active_window()
+        p = rust_proc.RustProc()
+        listener = rust_proc.SlurpListener()
+        p.run(window, ['cat', self.output.name], plugin_path, listener,
+              chunked=chunked, json_reasons=json_reasons)
+        p.wait()
+        total = len(listener.json) + len(listener.data) + p.json_skipped
+        self.assertEqual(total, self.num_lines)
+        return total / p.elapsed
+
+    def test_read_stdout(self):
+        if sys.platform == 'win32':
+            self.skipTest('Requires `cat`.')
+        before = self._lines_per_second(chunked=False)
+        after = self._lines_per_second(chunked=True)
+        filtered = self._lines_per_second(chunked=True,
+            json_reasons=rust_proc.DIAGNOSTIC_REASONS)
+        print('RustProc line reader:    %10.0f lines/s' % (before,))
+        print('RustProc chunked reader: %10.0f lines/s' % (after,))
+        print('RustProc reason filter:  %10.0f lines/s' % (filtered,))
+
+    def _first_byte_latency(self, spawn_method, runs=50):
+        window = sublime.active_window()
+        total = 0.0
+        for i in range(runs):
+            p = rust_proc.RustProc()
+            p.spawn_method = spawn_method
+            listener = FirstByteListener()
+            start = time.time()
+            p.run(window, ['echo', 'x'], plugin_path, listener,
+                  decode_json=False)
+            p.wait()
+            total += listener.first_byte - start
+        return total / runs
+
+    def test_spawn_latency(self):
+        if sys.platform == 'win32':
+            self.skipTest('Spawn methods are POSIX only.')
+        methods = ['preexec', 'session']
+        if sys.version_info >= (3, 11):
+            methods.append('process_group')
+        for method in methods:
+            latency = self._first_byte_latency(method)
+            print('RustProc spawn to first byte (%s): %7.2f ms' % (
+                method, latency * 1000))
+
+
+class FirstByteListener(rust_proc.SlurpListener):
+
+    first_byte = None
+
+    def on_data_batch(self, proc, lines):
+        if self.first_byte is None:
+            self.first_byte = time.time()
+        super(FirstByteListener, self).on_data_batch(proc, lines)
@@ -252,6 +252,8 @@ class UiIntercept(object):
 
     def __enter__(self):
         self.phantoms = {}
+        self.erased_phantoms = []
+        self.phantom_ids = 0
         self.view_regions = {}
         self.popups = {}
 
@@ -280,7 +282,15 @@ class UiIntercept(object):
                 'on_navigate': on_navigate,
             })
             if self.passthrough:
-                self.orig_add_phantom(v, key, region, content, layout, on_navigate)
+                return self.orig_add_phantom(v, key, region, content, layout,
+                                             on_navigate)
+            self.phantom_ids += 1
+            return self.phantom_ids
+
+        def collect_erased(v, phantom_id):
+            self.erased_phantoms.append(phantom_id)
+            if self.passthrough:
+                self.orig_erase_phantom(v, phantom_id)
 
         def collect_regions(v, key, regions, scope, icon, flags):
             rs = self.view_regions.setdefault(v.file_name(), [])
@@ -290,9 +300,11 @@ class UiIntercept(object):
 
         m = plugin.rust.messages
         self.orig_add_phantom = m._sublime_add_phantom
+        self.orig_erase_phantom = m._sublime_erase_phantom
         self.orig_add_regions = m._sublime_add_regions
         self.orig_show_popup = m._sublime_show_popup
         m._sublime_add_phantom = collect_phantoms
+        m._sublime_erase_phantom = collect_erased
         m._sublime_add_regions = collect_regions
         m._sublime_show_popup = collect_popups
         return self
@@ -300,6 +312,7 @@ class UiIntercept(object):
     def __exit__(self, type, value, traceback):
         m = plugin.rust.messages
         m._sublime_add_phantom = self.orig_add_phantom
+        m._sublime_erase_phantom = self.orig_erase_phantom
         m._sublime_add_regions = self.orig_add_regions
         m._sublime_show_popup = self.orig_show_popup
 
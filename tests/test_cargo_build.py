@@ -45,8 +45,8 @@ def debug_wrapper(f):
         except:
             print('Test failed.')
             print('Messages are:')
-            for window, info in messages.WINDOW_MESSAGES.items():
-                for path, msgs in info['paths'].items():
+            for window, store in messages.WINDOW_MESSAGES.items():
+                for path, msgs in store.paths.items():
                     print(path)
                     for msg in msgs:
                         pprint(msg)
@@ -377,7 +377,7 @@ class TestCargoBuild(TestBase):
         self._check_added_message(view.window(), view.file_name(), r'char_lit_as_u8')
 
     def _check_added_message(self, window, filename, pattern):
-        batches = messages.WINDOW_MESSAGES[window.id()]['paths'][filename]
+        batches = messages.WINDOW_MESSAGES[window.id()].paths[filename]
         for batch in batches:
             for msg in batch:
                 if re.search(pattern, msg.text):
@@ -0,0 +1,77 @@
+"""Tests for the Cargo metadata cache."""
+
+import os
+import tempfile
+import threading
+import time
+
+from rust_test_common import *
+
+metadata = plugin.rust.metadata
+
+
+class TestMetadata(TestBase):
+
+    def setUp(self):
+        super(TestMetadata, self).setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp_dir.name)
+        self.member = os.path.join(self.root, 'member')
+        os.mkdir(self.member)
+        for path in (self.root, self.member):
+            with open(os.path.join(path, 'Cargo.toml'), 'w') as f:
+                f.write('')
+        self.runs = 0
+        # Set to let a refresh finish.
+        self.release = threading.Event()
+        self.orig_run_metadata = metadata._run_metadata
+        metadata._run_metadata = self._run_metadata
+        metadata.clear()
+
+    def tearDown(self):
+        self.release.set()
+        metadata._run_metadata = self.orig_run_metadata
+        metadata.clear()
+        self.tmp_dir.cleanup()
+        super(TestMetadata, self).tearDown()
+
+    def _run_metadata(self, window, cwd, toolchain, owner=None):
+        self.runs += 1
+        if self.runs > 1:
+            self.release.wait(5)
+        return {
+            'workspace_root': self.root,
+            'packages': [{
+                'name': 'member',
+                'manifest_path': os.path.join(self.member, 'Cargo.toml'),
+            }],
+            'run': self.runs,
+        }
+
+    def _get(self):
+        return metadata.get_cargo_metadata(sublime.active_window(),
+                                           self.member)
+
+    def _wait(self, cond):
+        for _ in range(500):
+            if cond():
+                return
+            time.sleep(0.01)
+        raise AssertionError('Timed out.')
+
+    def test_refresh(self):
+        self.assertEqual(self._get()['run'], 1)
+        self.assertEqual(self._get()['run'], 1)
+        self.assertEqual(self.runs, 1)
+        # Editing a member manifest makes the entry stale.  The old value
+        # is returned while a single refresh runs in the background.
+        manifest = os.path.join(self.member, 'Cargo.toml')
+        st = os.stat(manifest)
+        os.utime(manifest, (st.st_atime, st.st_mtime + 10))
+        for _ in range(5):
+            self.assertEqual(self._get()['run'], 1)
+        self._wait(lambda: self.runs == 2)
+        self.assertEqual(self._get()['run'], 1)
+        self.release.set()
+        self._wait(lambda: self._get()['run'] == 2)
+        self.assertEqual(self.runs, 2)
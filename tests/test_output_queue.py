@@ -0,0 +1,61 @@
+"""Tests for the output panel queue."""
+
+import os
+
+from rust_test_common import *
+
+
+class TestOutputQueue(TestBase):
+
+    def setUp(self):
+        super(TestOutputQueue, self).setUp()
+        # The tests flush the queue themselves.
+        self._override_setting('rust_output_flush_interval', 60000)
+        self._override_setting('rust_output_buffer_size', 10)
+        self.output = []
+
+    def _make_queue(self, policy):
+        self._override_setting('rust_output_overflow', policy)
+        return plugin.rust.opanel.OutputQueue(sublime.active_window(),
+                                              self.output.append)
+
+    def test_drop_oldest(self):
+        q = self._make_queue('drop_oldest')
+        q.put_text('a\na\na\n')
+        q.put_text('b\nb\nb\n')
+        q.put_call(lambda: self.output.append('call'))
+        q.put_text('c\n')
+        q.flush()
+        self.assertEqual(self.output, [
+            '[3 lines of output dropped]\n',
+            'b\nb\nb\n',
+            'call',
+            'c\n',
+        ])
+        self.assertEqual(q.dropped, 3)
+
+    def test_spill(self):
+        q = self._make_queue('spill')
+        q.put_text('a' * 5)
+        q.put_text('b' * 20)
+        q.put_call(lambda: self.output.append('call'))
+        # Text queued while spilling goes after the spilled text.
+        q.put_text('c\n')
+        spill_path = q.spill_path
+        self.assertTrue(os.path.exists(spill_path))
+        # Each flush displays at most `rust_output_buffer_size` characters
+        # from the spill file.
+        q.flush()
+        self.assertEqual(self.output, ['a' * 5 + 'b' * 10])
+        q.flush()
+        self.assertEqual(self.output[1:], ['b' * 10, 'call'])
+        self.assertTrue(q.spilling)
+        q.flush()
+        self.assertEqual(self.output[3:], ['c\n'])
+        # Everything has been displayed, so the file is gone.
+        self.assertFalse(q.spilling)
+        self.assertFalse(os.path.exists(spill_path))
+        q.put_text('d\n')
+        q.flush()
+        self.assertEqual(''.join(x for x in self.output if x != 'call'),
+                         'a' * 5 + 'b' * 20 + 'c\nd\n')
@@ -55,3 +55,74 @@ class TestPhantomStyle(TestBase):
                 self.assertEqual(len(popups), 1)
                 self.assertIn('cast to unsized type', popups[0]['content'])
                 ui.popups.clear()
+
+    def test_lazy_limit(self):
+        self._override_setting('rust_phantom_lazy', True)
+        self._override_setting('rust_phantom_lazy_limit', 1)
+        self._with_open_file('tests/error-tests/tests/cast-to-unsized-trait-object-suggestion.rs',
+            self._test_lazy_limit)
+
+    def _test_lazy_limit(self, view):
+        with UiIntercept(passthrough=True) as ui:
+            e = plugin.SyntaxCheckPlugin.RustSyntaxCheckEvent()
+            self._cargo_clean(view)
+            e.on_post_save(view)
+            self._get_rust_thread().join()
+            self.assertEqual(len(ui.phantoms[view.file_name()]), 1)
+            # Regions are still drawn for every message.
+            regions = ui.view_regions[view.file_name()]
+            rs = [(r.a, r.b) for r in regions]
+            self.assertEqual(len(set(rs)), 4)
+
+    def test_phantom_manager(self):
+        self._with_open_file('tests/error-tests/tests/cast-to-unsized-trait-object-suggestion.rs',
+            self._test_phantom_manager)
+
+    def _test_phantom_manager(self, view):
+        messages.discard_phantom_manager(view)
+        with UiIntercept() as ui:
+            manager = messages.get_phantom_manager(view)
+            try:
+                r1 = sublime.Region(0, 1)
+                r2 = sublime.Region(2, 3)
+
+                def added():
+                    result = [p['content']
+                              for p in ui.phantoms.get(view.file_name(), [])]
+                    ui.phantoms.clear()
+                    return result
+
+                manager.set('a', r1, 'A', None)
+                manager.set('b', r2, 'B', None)
+                manager.flush()
+                self.assertEqual(added(), ['A', 'B'])
+                # Setting the same phantom again does not update anything.
+                manager.set('a', r1, 'A', None)
+                manager.flush()
+                self.assertEqual(added(), [])
+                # Only the changed phantoms are added and erased, the
+                # others are kept.
+                manager.discard('a')
+                manager.set('c', r1, 'C', None)
+                manager.flush()
+                self.assertEqual(added(), ['C'])
+                self.assertEqual(len(ui.erased_phantoms), 1)
+                self.assertEqual(manager.keys(), {'b', 'c'})
+                self.assertEqual(set(manager.shown), {'b', 'c'})
+                # Views of the same buffer share the manager.
+                window = view.window()
+                window.run_command('clone_file')
+                clone = window.active_view()
+                try:
+                    self.assertNotEqual(clone.id(), view.id())
+                    self.assertIs(messages.get_phantom_manager(clone),
+                                  manager)
+                finally:
+                    clone.close()
+                manager.clear()
+                manager.flush()
+                self.assertEqual(added(), [])
+                self.assertEqual(len(ui.erased_phantoms), 3)
+                self.assertEqual(manager.shown, {})
+            finally:
+                messages.discard_phantom_manager(view)
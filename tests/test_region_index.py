@@ -0,0 +1,98 @@
+"""Tests for the message region index."""
+
+import random
+
+from rust_test_common import *
+
+RegionIndex = plugin.rust.region_index.RegionIndex
+
+
+class TestRegionIndex(unittest.TestCase):
+
+    def _regions(self, index):
+        return [index.region(i) for i in range(len(index))]
+
+    def test_overlapping(self):
+        index = RegionIndex([
+            (10, 12, 'c'),
+            (0, 5, 'a'),
+            (3, 8, 'b'),
+            (20, 20, 'd'),
+        ])
+        self.assertEqual(len(index), 4)
+        # Ends are inclusive.
+        self.assertEqual(index.overlapping(5), ['a', 'b'])
+        self.assertEqual(index.overlapping(9), [])
+        self.assertEqual(index.overlapping(5, 10), ['a', 'b', 'c'])
+        self.assertEqual(index.overlapping(20), ['d'])
+        self.assertEqual(index.overlapping(21, 100), [])
+        self.assertEqual(RegionIndex([]).overlapping(0, 100), [])
+
+    def test_overlapping_random(self):
+        """Compare against a linear search."""
+        rng = random.Random(1)
+        for n in (1, 2, 7, 33):
+            entries = []
+            for i in range(n):
+                begin = rng.randrange(100)
+                entries.append((begin, begin + rng.randrange(20), i))
+            index = RegionIndex(entries)
+            ordered = sorted(entries, key=lambda e: (e[0], e[1]))
+            for _ in range(50):
+                lo = rng.randrange(120)
+                hi = lo + rng.randrange(10)
+                expected = [e[2] for e in ordered
+                            if e[0] <= hi and e[1] >= lo]
+                self.assertEqual(index.overlapping(lo, hi), expected)
+
+    def test_apply_change_shift(self):
+        index = RegionIndex([(10, 15, 'a'), (20, 25, 'b'), (30, 35, 'c')])
+        # Insert before everything.
+        self.assertEqual(index.apply_change(0, 0, 3), [])
+        self.assertEqual(self._regions(index),
+                         [(13, 18), (23, 28), (33, 38)])
+        # Delete between regions, only the later ones move.
+        self.assertEqual(index.apply_change(19, 22, 0), [])
+        self.assertEqual(self._regions(index),
+                         [(13, 18), (20, 25), (30, 35)])
+        # An edit after everything changes nothing.
+        self.assertEqual(index.apply_change(40, 40, 5), [])
+        self.assertEqual(self._regions(index),
+                         [(13, 18), (20, 25), (30, 35)])
+        self.assertEqual(index.overlapping(24), ['b'])
+
+    def test_apply_change_touching(self):
+        index = RegionIndex([(10, 15, 'a'), (20, 25, 'b'), (30, 35, 'c')])
+        # Insert inside a region: it grows, the later ones shift.
+        self.assertEqual(index.apply_change(12, 12, 4), [0])
+        self.assertEqual(self._regions(index),
+                         [(10, 19), (24, 29), (34, 39)])
+        # Replace text covering the start of a region.
+        self.assertEqual(index.apply_change(22, 26, 1), [1])
+        self.assertEqual(self._regions(index),
+                         [(10, 19), (22, 26), (31, 36)])
+        # Delete a whole region.
+        self.assertEqual(index.apply_change(30, 37, 0), [2])
+        self.assertEqual(self._regions(index),
+                         [(10, 19), (22, 26), (30, 30)])
+        self.assertEqual(index.overlapping(30), ['c'])
+
+    def test_set_region(self):
+        index = RegionIndex([(10, 15, 'a'), (20, 25, 'b'), (30, 35, 'c')])
+        index.apply_change(0, 0, 5)
+        self.assertTrue(index.set_region(1, 22, 40))
+        self.assertEqual(self._regions(index),
+                         [(15, 20), (22, 40), (35, 40)])
+        self.assertEqual(index.overlapping(38), ['b', 'c'])
+        # Moving a region past its neighbours is refused.
+        self.assertFalse(index.set_region(1, 36, 40))
+        self.assertFalse(index.set_region(1, 14, 40))
+        self.assertEqual(self._regions(index),
+                         [(15, 20), (22, 40), (35, 40)])
+        # Rebuild with the new positions.
+        regions = self._regions(index)
+        regions[1] = (36, 40)
+        index = RegionIndex([r + (payload,) for r, payload
+                             in zip(regions, index.payloads)])
+        self.assertEqual(index.payloads, ['a', 'c', 'b'])
+        self.assertEqual(index.overlapping(36), ['c', 'b'])
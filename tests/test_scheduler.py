@@ -0,0 +1,141 @@
+"""Tests for the thread scheduler."""
+
+import threading
+import time
+
+from rust_test_common import *
+
+
+class FakeThread(rust_thread.RustThread):
+
+    """A thread that runs until it is released or terminated."""
+
+    def __init__(self, window, name, priority, key,
+                 wait_if_busy=False, started=None):
+        super(FakeThread, self).__init__(window)
+        self.name = name
+        self.priority = priority
+        self.key = key
+        self.wait_if_busy = wait_if_busy
+        # List shared between threads to record the order they run.
+        self.started = started if started is not None else []
+        self.running = threading.Event()
+        self.release = threading.Event()
+
+    def job_key(self):
+        return (self.key,)
+
+    def run(self):
+        self.started.append(self.name)
+        self.running.set()
+        while not self.release.is_set() and not self.should_exit:
+            time.sleep(0.01)
+
+
+class TestScheduler(TestBase):
+
+    def setUp(self):
+        super(TestScheduler, self).setUp()
+        self.window = sublime.active_window()
+        self.scheduler = rust_thread.get_scheduler(self.window)
+        self.scheduler.cancel()
+        self.threads = []
+        self.started = []
+
+    def tearDown(self):
+        super(TestScheduler, self).tearDown()
+        self.scheduler.cancel()
+        for t in self.threads:
+            t.join(5)
+
+    def _start(self, name, priority, key=None, wait_if_busy=False):
+        t = FakeThread(self.window, name, priority, key or name,
+                       wait_if_busy=wait_if_busy, started=self.started)
+        self.threads.append(t)
+        t.start()
+        self._wait(lambda: (t.running.is_set() or not t.is_alive() or
+                            t in self.scheduler.pending))
+        return t
+
+    def _wait(self, cond):
+        for _ in range(500):
+            if cond():
+                return
+            time.sleep(0.01)
+        raise AssertionError('Timed out.')
+
+    def _finish(self, *threads):
+        for t in threads:
+            t.release.set()
+            t.join(5)
+            self.assertFalse(t.is_alive())
+
+    def test_priority(self):
+        """Waiting threads run in order of priority, then submission."""
+        blocker = self._start('blocker', rust_thread.PRIORITY_INTERACTIVE)
+        self.assertTrue(blocker.running.is_set())
+        bg = self._start('bg', rust_thread.PRIORITY_BACKGROUND,
+                         wait_if_busy=True)
+        check1 = self._start('check1', rust_thread.PRIORITY_CHECK,
+                             wait_if_busy=True)
+        check2 = self._start('check2', rust_thread.PRIORITY_CHECK,
+                             wait_if_busy=True)
+        self.assertFalse(blocker.should_exit)
+        blocker.release.set()
+        self._wait(lambda: check1.running.is_set())
+        self._finish(check1)
+        self._wait(lambda: check2.running.is_set())
+        self._finish(check2)
+        self._wait(lambda: bg.running.is_set())
+        self._finish(bg)
+        self.assertEqual(self.started, ['blocker', 'check1', 'check2', 'bg'])
+
+    def test_preempt(self):
+        """A more important thread terminates the running one, and a less
+        important one is discarded."""
+        check = self._start('check', rust_thread.PRIORITY_CHECK)
+        self.assertTrue(check.running.is_set())
+        bg = self._start('bg', rust_thread.PRIORITY_BACKGROUND)
+        bg.join(5)
+        self.assertFalse(bg.running.is_set())
+        self.assertFalse(check.should_exit)
+        build = self._start('build', rust_thread.PRIORITY_INTERACTIVE)
+        self._wait(lambda: build.running.is_set())
+        self.assertTrue(check.should_exit)
+        self._finish(build)
+        self.assertEqual(self.started, ['check', 'build'])
+
+    def test_merge(self):
+        """A pending thread is replaced by a newer one doing the same
+        work."""
+        blocker = self._start('blocker', rust_thread.PRIORITY_INTERACTIVE)
+        a1 = self._start('a1', rust_thread.PRIORITY_CHECK, key='a',
+                         wait_if_busy=True)
+        b = self._start('b', rust_thread.PRIORITY_CHECK, key='b',
+                        wait_if_busy=True)
+        a2 = self._start('a2', rust_thread.PRIORITY_CHECK, key='a',
+                         wait_if_busy=True)
+        self.assertTrue(a1.should_exit)
+        self.assertFalse(b.should_exit)
+        self._finish(blocker)
+        self._wait(lambda: b.running.is_set())
+        self._finish(b)
+        self._wait(lambda: a2.running.is_set())
+        self._finish(a2)
+        a1.join(5)
+        self.assertEqual(self.started, ['blocker', 'b', 'a2'])
+
+    def test_cargo_exec_job_key(self):
+        """Cargo commands are only merged with the same command."""
+        def make(command_name, initial_settings):
+            return plugin.cargo_build.CargoExecThread(
+                self.window, None, command_name, {}, initial_settings,
+                None, plugin_path)
+
+        self.assertEqual(make('build', {}).job_key(),
+                         make('build', {}).job_key())
+        self.assertNotEqual(make('build', {}).job_key(),
+                            make('test', {}).job_key())
+        self.assertNotEqual(
+            make('run', {'extra_run_args': 'a'}).job_key(),
+            make('run', {'extra_run_args': 'b'}).job_key())
@@ -0,0 +1,72 @@
+"""Tests for the login shell environment cache."""
+
+import os
+import tempfile
+
+from rust_test_common import *
+
+shell_env = plugin.rust.shell_env
+
+
+class TestShellEnv(TestBase):
+
+    def setUp(self):
+        super(TestShellEnv, self).setUp()
+        if sys.platform == 'win32':
+            self.skipTest('No shell cache on Windows.')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.rc_path = os.path.join(self.tmp_dir.name, 'rc')
+        with open(self.rc_path, 'w') as f:
+            f.write('')
+        self.captures = 0
+
+        def get_env():
+            self.captures += 1
+            return '/bin/fakesh', {'CAPTURE': str(self.captures)}
+
+        self.orig = {
+            '_env': shell_env._env,
+            '_cache_file': shell_env._cache_file,
+            '_login_shell': shell_env._login_shell,
+            'DEFAULT_RC_FILES': shell_env.DEFAULT_RC_FILES,
+        }
+        self.orig_get_env = shell_env.shellenv.get_env
+        shell_env._env = None
+        shell_env._cache_file = lambda: os.path.join(self.tmp_dir.name,
+                                                     'shell_env.json')
+        shell_env._login_shell = lambda: '/bin/fakesh'
+        shell_env.DEFAULT_RC_FILES = [self.rc_path]
+        shell_env.shellenv.get_env = get_env
+
+    def tearDown(self):
+        if hasattr(self, 'orig'):
+            for name, value in self.orig.items():
+                setattr(shell_env, name, value)
+            shell_env.shellenv.get_env = self.orig_get_env
+            self.tmp_dir.cleanup()
+        super(TestShellEnv, self).tearDown()
+
+    def _reload(self):
+        # Forget the in-memory copy, like a Sublime restart.
+        shell_env._env = None
+        return shell_env.get_env()
+
+    def test_cache_key(self):
+        self.assertEqual(self._reload(), {'CAPTURE': '1'})
+        # Loaded from the disk cache.
+        self.assertEqual(self._reload(), {'CAPTURE': '1'})
+        self.assertEqual(self.captures, 1)
+        # Editing a startup file invalidates the cache.
+        st = os.stat(self.rc_path)
+        os.utime(self.rc_path, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(self._reload(), {'CAPTURE': '2'})
+        self.assertEqual(self._reload(), {'CAPTURE': '2'})
+        # So does a different shell.
+        shell_env._login_shell = lambda: '/bin/othersh'
+        self.assertEqual(self._reload(), {'CAPTURE': '3'})
+        # And clearing the cache.
+        generation = shell_env.generation
+        shell_env.clear()
+        self.assertEqual(shell_env.generation, generation + 1)
+        self.assertEqual(shell_env.get_env(), {'CAPTURE': '4'})
+        self.assertEqual(self.captures, 4)
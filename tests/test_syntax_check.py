@@ -156,6 +156,90 @@ class TestSyntaxCheck(TestBase):
         for path in to_test:
             self._with_open_file(path, self._test_messages, setups=setups)
 
+    def test_early_stop(self):
+        """Test stopping the check once the saved file's target is done."""
+        self._override_setting('rust_syntax_checking_early_stop', True)
+        self._with_open_file('tests/multi-targets/build.rs',
+            self._test_early_stop_build_script)
+        self._with_open_file('tests/multi-targets/src/lib.rs',
+            self._test_early_stop_lib)
+
+    def _run_check(self, view):
+        e = plugin.SyntaxCheckPlugin.RustSyntaxCheckEvent()
+        self._cargo_clean(view)
+        e.on_post_save(view)
+        t = self._get_rust_thread()
+        t.join()
+        return t
+
+    def _test_early_stop_build_script(self, view):
+        # The target of build.rs is not detected, so the whole package is
+        # checked, and it stops after the build script.
+        t = self._run_check(view)
+        self.assertTrue(t.stopped_early)
+        lib = os.path.join(os.path.dirname(view.file_name()), 'src', 'lib.rs')
+        self.assertFalse(messages.has_message_for_path(view.window(), lib))
+
+    def _test_early_stop_lib(self, view):
+        # Messages of the library's unit (with the test profile) are kept.
+        self._run_check(view)
+        self.assertTrue(messages.has_message_for_path(view.window(),
+                                                      view.file_name()))
+
+    def test_combined_targets(self):
+        """Test checking a file shared by several targets with one Cargo
+        command."""
+        self._with_open_file('tests/multi-targets/tests/common/helpers.rs',
+            self._test_combined_targets)
+
+    def _test_combined_targets(self, view):
+        window = view.window()
+        root = os.path.join(plugin_path, 'tests', 'multi-targets')
+        test_srcs = {os.path.join(root, 'tests', name)
+                     for name in ('test1.rs', 'test2.rs', 'test_context.rs')}
+        runs = []
+        target_paths = []
+        cls = plugin.SyntaxCheckPlugin.RustSyntaxCheckThread
+        orig_run_check = cls._run_check
+        orig_add_rust_messages = messages.add_rust_messages
+
+        def run_check(thread, method, command_info, settings, metadata,
+                      initial_settings, target_src, target_args, *args):
+            runs.append((thread.combined_targets, ' '.join(target_args)))
+            return orig_run_check(thread, method, command_info, settings,
+                                  metadata, initial_settings, target_src,
+                                  target_args, *args)
+
+        def add_rust_messages(window, base_path, info, target_path, msg_cb):
+            target_paths.append(target_path)
+            orig_add_rust_messages(window, base_path, info, target_path,
+                                   msg_cb)
+
+        cls._run_check = run_check
+        messages.add_rust_messages = add_rust_messages
+        try:
+            self._run_check(view)
+            self.assertEqual(runs, [
+                (True, '--test test1 --test test2 --test test_context')])
+            # Each message is attributed to the target it came from.
+            self.assertTrue(target_paths)
+            self.assertLessEqual(set(target_paths), test_srcs)
+            self.assertTrue(messages.has_message_for_path(window,
+                                                          view.file_name()))
+
+            # A target with its own settings is checked on its own, so that
+            # the settings apply.
+            settings = cargo_settings.CargoSettings(window)
+            settings.load()
+            settings.set_project_package_target(root, '--test test1',
+                'features', 'feat2')
+            del runs[:]
+            self._run_check(view)
+            self.assertEqual(runs[0], (False, '--test test1'))
+        finally:
+            cls._run_check = orig_run_check
+            messages.add_rust_messages = orig_add_rust_messages
+
     def _test_messages(self, view, setups=None, extra_paths=()):
         self._override_setting('rust_message_theme', 'test')
         # Don't insert <br> tags during tests.
@@ -264,9 +348,8 @@ class TestSyntaxCheck(TestBase):
         # First collect all the messages for all the themes.
         theme_data = {}
         for theme in theme_names:
-            batches = messages.WINDOW_MESSAGES.get(sublime.active_window().id(), {})\
-                                              .get('paths', {})\
-                                              .get(view.file_name(), [])
+            store = messages.WINDOW_MESSAGES.get(sublime.active_window().id())
+            batches = store.batches(view.file_name()) if store else []
             theme_data[theme] = output = []
             for batch in batches:
                 output.append(themes.THEMES[theme].render(view, batch))
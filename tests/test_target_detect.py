@@ -72,3 +72,30 @@ class TestTargetDetect(TestBase):
         targets = t.determine_targets(view.file_name())
         targets.sort()
         self.assertEqual(targets, expected_targets)
+
+    def test_workspace_packages(self):
+        """Test finding the owning package and its dependents."""
+        root = os.path.join(plugin_path, 'tests', 'workspace')
+
+        def package(name, deps):
+            return {
+                'name': name,
+                'manifest_path': os.path.join(root, name, 'Cargo.toml'),
+                'dependencies': [{'name': dep} for dep in deps],
+            }
+
+        metadata = {'packages': [
+            package('core', []),
+            package('core-ext', ['core', 'serde']),
+            package('app', ['core-ext']),
+            package('other', ['serde']),
+        ]}
+        t = target_detect.TargetDetector(sublime.active_window())
+        owner = t.find_package(os.path.join(root, 'core-ext', 'src', 'lib.rs'),
+                               metadata)
+        self.assertEqual(owner['name'], 'core-ext')
+        self.assertIsNone(t.find_package(os.path.join(plugin_path, 'x.rs'),
+                                         metadata))
+        self.assertEqual(t.reverse_dependents('core', metadata),
+                         ['app', 'core-ext'])
+        self.assertEqual(t.reverse_dependents('app', metadata), [])
@@ -0,0 +1,75 @@
+"""Tests for watching a workspace for external changes."""
+
+import os
+import tempfile
+import threading
+import time
+
+from rust_test_common import *
+
+watcher = plugin.rust.watcher
+
+
+class TestWatcher(TestBase):
+
+    def setUp(self):
+        super(TestWatcher, self).setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.realpath(self.tmp_dir.name)
+        for name in ('src', 'target', '.git'):
+            os.mkdir(os.path.join(self.root, name))
+        self.batches = []
+        self.changed = threading.Event()
+        self.watcher = None
+
+    def tearDown(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher._thread.join(5)
+        self.tmp_dir.cleanup()
+        super(TestWatcher, self).tearDown()
+
+    def _callback(self, paths):
+        self.batches.append(paths)
+        self.changed.set()
+
+    def _write(self, *parts):
+        with open(os.path.join(self.root, *parts), 'w') as f:
+            f.write('// changed\n')
+
+    def _test_batch(self):
+        self.watcher = watcher.Watcher(self.root, self._callback, delay=0.3,
+                                       poll_interval=0.1)
+        self.watcher.start()
+        # Give the watcher time to set up its watches or initial scan.
+        time.sleep(0.5)
+        self._write('src', 'a.rs')
+        self._write('target', 'out.rs')
+        self._write('.git', 'x.rs')
+        self._write('src', 'notes.txt')
+        time.sleep(0.1)
+        self._write('src', 'b.rs')
+        self.assertTrue(self.changed.wait(5))
+        # Wait to see if any other batch arrives.
+        time.sleep(1)
+        self.assertEqual(self.batches, [{
+            os.path.join(self.root, 'src', 'a.rs'),
+            os.path.join(self.root, 'src', 'b.rs'),
+        }])
+
+    def test_batch(self):
+        """Changes are reported together, without the build and version
+        control directories."""
+        self._test_batch()
+        if sys.platform == 'linux':
+            self.assertEqual(self.watcher.method, 'inotify')
+
+    def test_batch_poll(self):
+        """Same as `test_batch` when polling."""
+        orig_create = watcher._Inotify.create
+        watcher._Inotify.create = classmethod(lambda cls: None)
+        try:
+            self._test_batch()
+        finally:
+            watcher._Inotify.create = orig_create
+        self.assertEqual(self.watcher.method, 'poll')